@@ -26,6 +26,14 @@ from UM.Message import Message
 import re
 import os
 
+# Temperature commands that get doubled by the Max Temperature Override
+_R_PREFIX = ("M109 R",)
+# For the whole-file pass a line starts at a newline or at the data item separator.
+_DATA_SEP = "\x00"
+_TEMP_RE = re.compile(r"(?:^|(?<=\x00))(M10[49] (?:T\d+ )?S|M109 R)(\d+)", re.MULTILINE)
+# Parameter value lookups that would otherwise go through Script.getValue on every line
+_PARAM_RE = {c: re.compile(rf" {c}(-?\d+(?:\.\d+)?)") for c in "SRF"}
+
 class LittleUtilities_v17(Script):
 
     def initialize(self) -> None:
@@ -1628,20 +1636,17 @@ class LittleUtilities_v17(Script):
         else:
             end_layer = end_layer - 1
         wipe_to_kill = self.getSettingValueByKey("wipe_to_kill")
+        start_marker = ";LAYER:" + str(start_layer) + "\n"
         for num in range(2, len(data) - self._final_lay_adj):
-            layer = data[num]
-            if ";LAYER:" + str(start_layer) + "\n" in layer:
+            if start_marker in data[num]:
                 start_index = num
                 break
         if end_layer != -1:
-            end_layer
+            end_marker = ";LAYER:" + str(end_layer) + "\n"
             for num in range(start_index, len(data) - 1):
-                layer = data[num]
-                if ";LAYER:" + str(end_layer) + "\n" in layer:
+                if end_marker in data[num]:
                     end_index = num
                     break
-        elif end_layer == -1:
-            end_index = len(data) - self._final_lay_adj
 
         # Message the user if they selected an option that isn't relevant
         if wipe_to_kill in ["infill_wipe", "both_wipe"] and not infill_wipe_enabled:
@@ -1656,59 +1661,79 @@ class LittleUtilities_v17(Script):
         if wipe_to_kill != "infill_wipe" and ow_wipe_enabled:
             for num in range(start_index, end_index, 1):
                 layer = data[num]
+                # Layers without an outer wall are left alone rather than split and rejoined
+                if not ";TYPE:WALL-OUTER" in layer:
+                    continue
                 nailed_it = False
-                if ";TYPE:WALL-OUTER" in layer:
-                    lines = layer.split("\n")
-                    for l_num, line in enumerate(lines):
-                        if not ";TYPE:WALL-OUTER" in line:
-                            continue
-                        else:
-                            # If Type:outer-wall then go down to the first ';' and work back up to the last extrusion.
-                            for semi_num in range(l_num + 1, len(lines)-1):
-                                if lines[semi_num].startswith(";"):
-                                    for c_num in range(semi_num-1, l_num, -1):
-                                        if re.match("G1 X(\d.*) Y(\d.*) E(\d.*)", lines[c_num]) is not None:
-                                            set_speed = ""
-                                            # If the line being commented has an F parameter grab it and insert it for following moves.
-                                            if " F" in lines[c_num + 1]:
-                                                f_val = self.getValue(lines[c_num + 1], "F")
-                                                set_speed = "\nG0 F" + str(f_val)
-                                            lines[c_num + 1] = ";" + lines[c_num + 1] + set_speed
-                                            nailed_it = True
-                                            break
-                                # Exit this for loop and continue checking the layer for additional Outer-Wall sections
-                                if nailed_it:
-                                    nailed_it = False
-                                    break
+                # The F values repeat within a layer so keep the 'G0 F' strings that have already been made for each one
+                f_cache = {}
+                lines = layer.split("\n")
+                for l_num, line in enumerate(lines):
+                    if not ";TYPE:WALL-OUTER" in line:
+                        continue
+                    else:
+                        # If Type:outer-wall then go down to the first ';' and work back up to the last extrusion.
+                        for semi_num in range(l_num + 1, len(lines)-1):
+                            if lines[semi_num].startswith(";"):
+                                for c_num in range(semi_num-1, l_num, -1):
+                                    if re.match("G1 X(\d.*) Y(\d.*) E(\d.*)", lines[c_num]) is not None:
+                                        set_speed = ""
+                                        # If the line being commented has an F parameter grab it and insert it for following moves.
+                                        nxt = lines[c_num + 1]
+                                        if " F" in nxt:
+                                            # The ' F' might only be in the comment
+                                            f_match = _PARAM_RE["F"].search(nxt)
+                                            if f_match:
+                                                f_val = f_match.group(1)
+                                                set_speed = f_cache.get(f_val)
+                                                if set_speed is None:
+                                                    set_speed = f_cache[f_val] = "\nG0 F" + f_val
+                                        lines[c_num + 1] = ";" + nxt + set_speed
+                                        nailed_it = True
+                                        break
+                            # Exit this for loop and continue checking the layer for additional Outer-Wall sections
+                            if nailed_it:
+                                nailed_it = False
+                                break
                 data[num] = "\n".join(lines)
         # If 'Infill' or 'Both' are selected check for Infill wipes
         if wipe_to_kill != "outer_wall_wipe" and infill_wipe_enabled:
             for num in range(start_index, end_index, 1):
                 layer = data[num]
+                # Layers without infill are left alone rather than split and rejoined
+                if not ";TYPE:FILL" in layer:
+                    continue
                 nailed_it = False
-                if ";TYPE:FILL" in layer:
-                    lines = layer.split("\n")
-                    for l_num, line in enumerate(lines):
-                        if not ";TYPE:FILL" in line:
-                            continue
-                        else:
-                            # If Type:Fill then go down to the first ';' and work back up to the last extrusion.
-                            for semi_num in range(l_num + 1, len(lines)-1):
-                                if lines[semi_num].startswith(";"):
-                                    for c_num in range(semi_num-1, l_num, -1):
-                                        if re.match("G1 X(\d.*) Y(\d.*) E(\d.*)", lines[c_num]) is not None:
-                                            set_speed = ""
-                                            # I the line being commented has an F parameter grab it and insert it for following moves.
-                                            if " F" in lines[c_num + 1]:
-                                                f_val = self.getValue(lines[c_num + 1], "F")
-                                                set_speed = "\nG0 F" + str(f_val)
-                                            lines[c_num + 1] = ";" + lines[c_num + 1] + set_speed
-                                            nailed_it = True
-                                            break
-                                # Exit this for loop and continue checking the layer for additional Infill sections
-                                if nailed_it:
-                                    nailed_it = False
-                                    break
+                # The F values repeat within a layer so keep the 'G0 F' strings that have already been made for each one
+                f_cache = {}
+                lines = layer.split("\n")
+                for l_num, line in enumerate(lines):
+                    if not ";TYPE:FILL" in line:
+                        continue
+                    else:
+                        # If Type:Fill then go down to the first ';' and work back up to the last extrusion.
+                        for semi_num in range(l_num + 1, len(lines)-1):
+                            if lines[semi_num].startswith(";"):
+                                for c_num in range(semi_num-1, l_num, -1):
+                                    if re.match("G1 X(\d.*) Y(\d.*) E(\d.*)", lines[c_num]) is not None:
+                                        set_speed = ""
+                                        # I the line being commented has an F parameter grab it and insert it for following moves.
+                                        nxt = lines[c_num + 1]
+                                        if " F" in nxt:
+                                            # The ' F' might only be in the comment
+                                            f_match = _PARAM_RE["F"].search(nxt)
+                                            if f_match:
+                                                f_val = f_match.group(1)
+                                                set_speed = f_cache.get(f_val)
+                                                if set_speed is None:
+                                                    set_speed = f_cache[f_val] = "\nG0 F" + f_val
+                                        lines[c_num + 1] = ";" + nxt + set_speed
+                                        nailed_it = True
+                                        break
+                            # Exit this for loop and continue checking the layer for additional Infill sections
+                            if nailed_it:
+                                nailed_it = False
+                                break
                 data[num] = "\n".join(lines)
         return
 
@@ -1724,7 +1749,8 @@ class LittleUtilities_v17(Script):
         if gap_len < 30: gap_len = 30
         for temp_index, temp_line in enumerate(temp_lines):
             if ";" in temp_line and not temp_line.startswith(";"):
-                temp_lines[temp_index] = temp_line.replace(temp_line.split(";")[0], temp_line.split(";")[0] + str(" " * (gap_len - 1 - len(temp_line.split(";")[0]))),1)
+                semi = temp_line.index(";")
+                temp_lines[temp_index] = temp_line[:semi].ljust(gap_len - 1) + temp_line[semi:]
         any_gcode_str = "\n".join(temp_lines)
         return any_gcode_str
 
@@ -1732,6 +1758,9 @@ class LittleUtilities_v17(Script):
         # Exit if the script is not enabled
         if not bool(self.getSettingValueByKey("temp_override_enable")):
             return alt_data
+        # Exit if there are no temperature lines to change
+        if not any(("M104" in block) or ("M109" in block) for block in alt_data):
+            return alt_data
         machine_extruder_count = int(self.global_stack.getProperty("machine_extruder_count", "value"))
         machine_extruders_enabled_count = int(self.global_stack.getProperty("extruders_enabled_count", "value"))
         # Exit if the printer has more than 2 extruders
@@ -1766,23 +1795,19 @@ class LittleUtilities_v17(Script):
     # Go though this if all the temperatures are being changed
     def _all_changes(self, alt_data: str) -> str:
         max_temp = 0
-        new_temp = 0
-        for num in range(1, len(alt_data)-1):
-            if "M104" in alt_data[num] or "M109" in alt_data[num]:
-                lines = alt_data[num].split("\n")
-                for index, line in enumerate(lines):
-                    if line.startswith("M104 S") or line.startswith("M109 S") or line.startswith("M104 T") or line.startswith("M109 T"):
-                        cur_temp = int(self.getValue(line, "S"))
-                        new_temp = cur_temp * 2
-                        lines[index] = line.replace("S" + str(cur_temp), "S" + str(new_temp), 1)
-                    if line.startswith("M109 R"):
-                        cur_temp = int(self.getValue(line, "R"))
-                        new_temp = cur_temp * 2
-                        lines[index] = line.replace("R" + str(cur_temp), "R" + str(new_temp), 1)
-                # Track the highest temperture so the user can be informed via a message
-                if new_temp > max_temp:
-                    max_temp = new_temp
-                alt_data[num] = "\n".join(lines)
+
+        def _dbl(match):
+            nonlocal max_temp
+            new_temp = int(match.group(2)) * 2
+            # Track the highest temperture so the user can be informed via a message
+            if new_temp > max_temp:
+                max_temp = new_temp
+            return match.group(1) + str(new_temp)
+
+        # Join the layers with a character that can't be in the gcode so one regex pass covers the whole file and it splits back losslessly
+        joined = _DATA_SEP.join(alt_data[1:-1])
+        joined = _TEMP_RE.sub(_dbl, joined)
+        alt_data[1:-1] = joined.split(_DATA_SEP)
         alt_data[1] = ";  [Little Utilities] The print temperatures have been doubled.  The new temperatures are as high as " + str(max_temp) + "°.\n" + alt_data[1]
         msg_text = "The post processor 'Little Utilities | Max Temp Override' is enabled. All the temperatures in the Cura settings have been doubled in the Gcode.  The new print temperatures are as high as " + str(max_temp) + "°.  Your printer and the material must be capable of handling the high temperatures.  It is up to the user to determine the suitablility of High Temperature Overrides."
         Message(title = "HIGH TEMP PRINT WARNING", text = msg_text).show()
@@ -1793,6 +1818,8 @@ class LittleUtilities_v17(Script):
         active_tool = "0"
         max_temp = 0
         new_temp = 0
+        active_prefixes = ("M104 S", "M109 S")
+        inactive_prefixes = ("M104 T" + tool_num, "M109 T" + tool_num)
         for num in range(1, len(alt_data)-1):
             lines = alt_data[num].split("\n")
             # Track the active tool number
@@ -1803,25 +1830,25 @@ class LittleUtilities_v17(Script):
                     active_tool = "1"
                 # Change the M104 and M109 lines of the active tool when it is equal to tool_num
                 if tool_num == active_tool:
-                    if line.startswith("M104 S") or line.startswith("M109 S"):
-                        cur_temp = int(self.getValue(line, "S"))
+                    if line.startswith(active_prefixes):
+                        cur_temp = int(float(_PARAM_RE["S"].search(line).group(1)))
                         new_temp = cur_temp * 2
                         lines[index] = line.replace("S" + str(cur_temp), "S" + str(new_temp), 1)
-                    if line.startswith("M109 R"):
-                        cur_temp = int(self.getValue(line, "R"))
+                    if line.startswith(_R_PREFIX):
+                        cur_temp = int(float(_PARAM_RE["R"].search(line).group(1)))
                         new_temp = cur_temp * 2
                         lines[index] = line.replace("R" + str(cur_temp), "R" + str(new_temp), 1)
                 # Change the heat up and cool down lines when the tool_num is inactive
                 else:
-                    if line.startswith("M104 T" + tool_num) or line.startswith("M109 T" + tool_num):
-                        cur_temp = int(self.getValue(line, "S"))
+                    if line.startswith(inactive_prefixes):
+                        cur_temp = int(float(_PARAM_RE["S"].search(line).group(1)))
                         new_temp = cur_temp * 2
                         lines[index] = line.replace("S" + str(cur_temp), "S" + str(new_temp), 1)
                 # Cura doesn't add 'M109 T R' lines for the inactive tool so that situation is ignored
                 # Track the highest temperture so the user can be informed via a message
                 if new_temp > max_temp:
                     max_temp = new_temp
-                alt_data[num] = "\n".join(lines)
+            alt_data[num] = "\n".join(lines)
         alt_data[1] = ";  [Little Utilities] The print temperatures for Tool 'T" + tool_num + "' have been doubled.  The new print temperatures are as high as " + str(max_temp) + "°.\n" + alt_data[1]
         msg_text = "The post processor 'Little Utilities | Max Temperature Override' is enabled. All the temperatures in the Cura settings for Tool 'T" + tool_num + "' have been doubled in the Gcode.  The new print temperatures are as high as " + str(max_temp) + "°.  Your printer and the material must be capable of handling the high temperatures.  It is up to the user to determine the suitablility of High Temperature Overrides."
         Message(title = "HIGH TEMP PRINT WARNING", text = msg_text).show()
@@ -1839,6 +1866,9 @@ class LittleUtilities_v17(Script):
             if ";LAYER:0" in alt_data[num]:
                 start_index = num + 1
                 break
+        # Exit if there are no prime tower sections to move tool changes into
+        if not any(";TYPE:PRIME-TOWER" in block for block in alt_data[start_index:]):
+            return alt_data
         pull_lines = ""
         prime_rad = self.global_stack.getProperty("prime_tower_size", "value") * 0.5
         prime_x = self.global_stack.getProperty("prime_tower_position_x", "value") - prime_rad
@@ -1855,7 +1885,7 @@ class LittleUtilities_v17(Script):
             lines = alt_data[num].split("\n")
             modified_data = ""
             for index, line in enumerate(lines):
-                if line.startswith("M135") or line.startswith("T"):
+                if line.startswith(("M135", "T")):
                     pull_lines = ""
                     p_index = index
                     pull_lines = f"\nG1 F{prime_feed} X{prime_x} Y{prime_y}"
@@ -7,6 +7,28 @@ from UM.Application import Application
 from UM.Message import Message
 import re
 
+# Z moves that are not part of an XY move (layer changes and Z-hops)
+_RE_G1_ZF = re.compile(r"G1 Z(\d.*) F(\d.*)")
+# LAYER lines, or the Z value of a line that has one in front of any comment
+_RE_Z_OR_LAYER = re.compile(r"^(;LAYER:.*)$|^[^;\n]* Z(-?[\d.]*)", re.MULTILINE)
+
+# Cura TYPE comments and the Flash Print 'structure' comments that replace them.  The support and custom types are handled separately.
+_TYPE_MAP = {
+    "TYPE:WALL-OUTER": "structure:shell-outer",
+    "TYPE:WALL-INNER": "structure:shell-inner",
+    "TYPE:FILL": "structure:infill-sparse",
+    "TYPE:SKIN": "structure:infill-solid",
+    "TYPE:SKIRT": "structure:pre-extrude\n;raft",
+    "TYPE:RAFT": "structure:raft",
+    "TYPE:BRIM": "structure:brim"}
+_TYPE_RE = re.compile("^;(" + "|".join(map(re.escape, _TYPE_MAP)) + ")", re.MULTILINE)
+# Line changes that don't depend on any earlier line are made on the whole layer at once
+_RE_TOOL = re.compile(r"^T(\d+).*$", re.MULTILINE)
+_RE_M107 = re.compile(r"^M107.*$", re.MULTILINE)
+_RE_G0_F = re.compile(r"^G0(?=.* F)", re.MULTILINE)
+# The feedrate of any line that has one, or a G0 that has no feedrate and gets the current one
+_RE_FEED_OR_G0 = re.compile(r"^[^;\n]* F(\d[\d.]*)|^G0(?!.* F)", re.MULTILINE)
+
 class MarlinToFlashForgeConverter(Script):
 
     def initialize(self) -> None:
@@ -14,8 +36,8 @@ class MarlinToFlashForgeConverter(Script):
         msg_txt = "NOTE:This script is not for use with multi-extruder printers.\n\nNOTE: This script is designed to produce a gcode that is acceptable to Flash Forge firmware and the Flash Print previewer.  Please let me know of any problems."
         Message(title = "[Marlin-to-FlashForge Converter (Beta)]", text = msg_txt).show()
 
-    def getSettingDataString(self):
-        return """{
+    # The settings never change so the JSON is a class constant
+    _SETTING_DATA = """{
             "name": "Marlin-to-FlashForge Converter One Extruder",
             "key": "MarlinToFlashForgeConverter",
             "metadata": {},
@@ -33,6 +55,9 @@ class MarlinToFlashForgeConverter(Script):
             }
         }"""
 
+    def getSettingDataString(self):
+        return self._SETTING_DATA
+
     def execute(self, data):
         # Exit if the script is not enabled
         if not self.getSettingValueByKey("enable_marlin_to_flash_forge_converter"):
@@ -42,14 +67,18 @@ class MarlinToFlashForgeConverter(Script):
         # Don't allow the script to run if the gcode has already been post-processed.
         if ";Flavor:FlashForge" in data[0]:
             return data
+        # Get all the settings up front so the property lookups stay out of the layer loops
         cooling_fan_nr = extruder[0].getProperty("machine_extruder_cooling_fan_number", "value")
         bv_fan_nr = curaApp.getProperty("build_volume_fan_nr", "value")
+        layer_height = str(curaApp.getProperty("layer_height", "value"))
+        layer_height_0 = float(curaApp.getProperty("layer_height_0", "value"))
+        z_hop_enabled = bool(extruder[0].getProperty("retraction_hop_enabled", "value"))
+        parse_params = self._parse_params
         
 #-------------------------------------------------------------------------------------------------------------------------
         # Change the G-Code flavor in line 1
         data[0] = "\n" + data[0]
-        data[0] = re.sub("Marlin", "FlashForge", data[0])
-        layer_height = str(curaApp.getProperty("layer_height", "value"))
+        data[0] = data[0].replace("Marlin", "FlashForge")
         # Insert the 'extruder_ratio' string at the G92 E0 closest to the start of the initial layer
         opening_paragraph = data[1].split("\n")
         for index, line in enumerate(opening_paragraph):
@@ -61,70 +90,81 @@ class MarlinToFlashForgeConverter(Script):
         lines = data[1].split("\n")
         for index, line in enumerate(lines):
             if line.startswith("M106 S"):
-                fan_speed = self.getValue(line, "S")
+                fan_speed = parse_params(line).get("S")
                 lines[index] = f"M106 S{fan_speed} T0"
             if line.startswith("M107"):
                 lines[index] = "M107 T0                      ; Fan off"
         data[1] = "\n".join(lines)
 
         # Go through all the layers and make the changes.
+        self._cur_feedrate = None
         for num in range(2, len(data)-1):
-            lines = data[num].split("\n")
+            # Tool changes, fan off lines, G0's that have a feedrate, and the "TYPE" lines don't need the line loop.
+            # Changing the "TYPE" lines to "structure" lines allows the preview to show correctly in Flash Print
+            layer = _RE_TOOL.sub(r"M108 T\1", data[num])
+            layer = _RE_M107.sub("M107 T0", layer)
+            layer = _RE_G0_F.sub("G1", layer)
+            layer = _TYPE_RE.sub(lambda m: ";" + _TYPE_MAP[m.group(1)], layer)
+            layer = self._mark_supports(layer)
+            lines = layer.split("\n")
             for index, line in enumerate(lines):
-                if line.startswith("T"):
-                    active_tool = str(self.getValue(line, "T"))
-                    lines[index] = f"M108 T{active_tool}"
-                    continue
+                # Most lines are movement lines so dispatch on the first character and skip the checks that can't apply
+                c0 = line[:1]
+                m_code = line[1:4] if c0 == "M" else ""
+                # Only the command lines need their parameters
+                params = parse_params(line) if c0 == "M" else {}
 
                 # Rearrange the tool numbers in the temperature lines.  Add the tool number if it isn't there.
-                if line.startswith("M104"):
-                    # yes tool - no comment
-                    if " T" in line and not ";" in line:
-                        tool_num = self.getValue(line, "T")
-                        temp = self.getValue(line, "S")
-                        lines[index] = f"M104 S{temp} T{tool_num}"
+                if m_code == "104":
+                    semi_idx = line.find(";")
+                    frt_part = line if semi_idx == -1 else line[:semi_idx]
+                    if " T" in frt_part:
+                        tool_num = params.get("T")
+                        temp = params.get("S")
+                        # yes tool - no comment
+                        if semi_idx == -1:
+                            lines[index] = f"M104 S{temp} T{tool_num}"
+                        # yes tool - yes comment
+                        else:
+                            c_comment = self._get_comment(line, semi_idx)
+                            lines[index] = f"M104 S{temp} T{tool_num}{c_comment[3:]}"
                     # no tool - no comment
-                    if not " T" in line and not ";" in line:
+                    elif semi_idx == -1:
                         lines[index] = line + " T0"
-                    # yes tool - yes comment
-                    if " T" in line and ";" in line:
-                        tool_num = self.getValue(line, "T")
-                        temp = self.getValue(line, "S")
-                        c_comment = self._get_comment(line)
-                        lines[index] = f"M104 S{temp} T{tool_num}{c_comment[3:]}"
                     # no tool - yes comment
-                    elif not "T" in line and ";" in line:
-                        frt_part = line.split(";")[0].rstrip()
-                        frt_part = frt_part + " T0"
-                        c_comment = self._get_comment(line)
-                        lines[index] = frt_part + c_comment[3:]
+                    else:
+                        c_comment = self._get_comment(line, semi_idx)
+                        lines[index] = frt_part.rstrip() + " T0" + c_comment[3:]
                     continue
-                if line.startswith("M109"):
-                    temp = self.getValue(line, line[5])
+                if m_code == "109":
+                    temp = params.get(line[5])
                     lines[index] = f"M104 S{temp} T0               ; Resume temperature\nM6                         ; Wait for hot end"
                     continue
-                if line.startswith("M190"):
-                    temp = self.getValue(line, "S")
+                if m_code == "190":
+                    temp = params.get("S")
                     lines[index] += f"M140 S{temp} T0\nM7"
                 # Move any F parameters to the end of the line
-                if " F" in line and self.getValue(line, "F") is not None:
-                    f_val = self.getValue(line, "F")
-                    if not ";" in line:
-                        lines[index] = lines[index].replace(" F" + str(f_val), "") + " F" + str(f_val)
-                    # If there is a comment at the end of the line it needs to be handled differently
-                    else:
-                        frt_part = line.split(";")[0].rstrip()
-                        c_comment = self._get_comment(line)
-                        frt_part = frt_part.replace(" F" + str(f_val), "") + " F" + str(f_val)
-                        lines[index] = frt_part + c_comment
+                f_idx = line.find(" F")
+                if f_idx != -1:
+                    semi_idx = line.find(";")
+                    f_end = f_idx + 2
+                    while f_end < len(line) and line[f_end] not in " ;":
+                        f_end += 1
+                    # Skip it if the F is in the comment or has no value
+                    if (semi_idx == -1 or f_idx < semi_idx) and f_end > f_idx + 2:
+                        f_part = line[f_idx:f_end]
+                        if semi_idx == -1:
+                            lines[index] = line[:f_idx] + line[f_end:] + f_part
+                        # If there is a comment at the end of the line it needs to be handled differently
+                        else:
+                            frt_part = (line[:f_idx] + line[f_end:semi_idx]).rstrip()
+                            c_comment = self._get_comment(line, semi_idx)
+                            lines[index] = frt_part + f_part + c_comment
 
                 # Make adjustments to the fan lines
-                if line.startswith("M107"):
-                    lines[index] = "M107 T0"
-                    continue
-                if line.startswith("M106") and " P" in line:
-                    fan_num = self.getValue(line, "P")
-                    fan_speed = self.getValue(line, "S")
+                if m_code == "106" and " P" in line:
+                    fan_num = params.get("P")
+                    fan_speed = params.get("S")
                     if fan_num != cooling_fan_nr:
                         if fan_speed > 0:
                             lines[index] = f"M651 S{fan_speed}"
@@ -133,103 +173,68 @@ class MarlinToFlashForgeConverter(Script):
                     else:
                         lines[index] = re.sub("P", "T", lines[index])
                         continue
-                if line.startswith("M106") and not "P" in line:
-                    fan_speed = self.getValue(line, "S")
+                if m_code == "106" and not "P" in line:
+                    fan_speed = params.get("S")
                     lines[index] = f"M106 S{fan_speed} T0"
                     continue
-                if " F" in line:
-                    cur_feedrate = self.getValue(line, "F")
-                # Change all G0 commands to G1's
-                if line.startswith("G0"):
-                    lines[index] = lines[index].replace("G0", "G1")
-                    if not " F" in line:
-                        lines[index] = lines[index].replace("G1", f"G1 F{cur_feedrate}")
-                    continue
-
-                # Changing the "TYPE" lines to "structure" lines allows the preview to show correctly in Flash Print
-                if "TYPE:WALL-OUTER" in line:
-                    lines[index] = lines[index].replace("TYPE:WALL-OUTER", "structure:shell-outer")
-                    continue
-                if "TYPE:WALL-INNER" in line:
-                    lines[index] = lines[index].replace("TYPE:WALL-INNER", "structure:shell-inner")
+                # The movement lines have nothing else to change
+                if c0 == "G":
                     continue
-                if "TYPE:FILL" in line:
-                    lines[index] = lines[index].replace("TYPE:FILL", "structure:infill-sparse")
-                    continue
-                if "TYPE:SKIN" in line:
-                    lines[index] = lines[index].replace("TYPE:SKIN", "structure:infill-solid")
-                    continue
-                if "TYPE:SKIRT" in line:
-                    lines[index] = lines[index].replace("TYPE:SKIRT", "structure:pre-extrude\n;raft")
-                    continue
-                if "TYPE:RAFT" in line:
-                    lines[index] = lines[index].replace("TYPE:RAFT", "structure:raft")
-                    continue
-                if "TYPE:BRIM" in line:
-                    lines[index] = lines[index].replace("TYPE:BRIM", "structure:brim")
-                    continue
-                if "TYPE:SUPPORT-INTERFACE" in line:
-                    lines[index] = ";support-start\n;structure:line-support-solid"
-                    new_index = index + 1
-                    for nr in range(new_index, len(lines) - 1):
-                        if lines[nr].startswith(";"):
-                            lines[nr] = ";support-end\n" + lines[nr]
-                            break
-                    continue
-                if "TYPE:SUPPORT" in line:
-                    lines[index] = ";support-start\n;structure:line-support-sparse"
-                    new_index = index + 1
-                    for nr in range(new_index, len(lines) - 1):
-                        if lines[nr].startswith(";"):
-                            lines[nr] = ";support-end\n" + lines[nr]
-                            break
+                # Only the comment lines can be TYPE lines.  The support handling may have put a 'support-end' line in front of one.
+                if not ";TYPE:" in line:
                     continue
                 if "TYPE:CUSTOM" in line:
                     lines[index] = lines[index] = ";structure:custom" + lines[index]
                     continue
-            data[num] = "\n".join(lines)
+            # Change the remaining G0 commands to G1's.  They get the feedrate of the last line that had one.
+            data[num] = _RE_FEED_OR_G0.sub(self._g0_feedrate, "\n".join(lines))
 
         # This final section adds the ';layer:x.xx' lines that indicate the layer height to the Flash Print Gcode pre-viewer.
         # Both Adaptive Layers and Z-hops must be considered.
-        cur_z = float(curaApp.getProperty("layer_height_0", "value"))
-        z_hop_enabled = bool(extruder[0].getProperty("retraction_hop_enabled", "value"))
+        cur_z = layer_height_0
         layer_hgt = cur_z
         working_z = cur_z
         prev_z = 0.0
         hop_up = False
+        # Index the data items that are layers once.  For one-at-a-time prints there are items in the data[list] that are not layers.
+        layer_indices = [num for num in range(1, len(data) - 1) if ";LAYER:" in data[num]]
         if not z_hop_enabled:
-            for num in range(2, len(data) - 1):
-                # For one-at-a-time items in the data[list] that are not layers.
-                if re.search(";LAYER:", data[num]) is None:
+            for num in layer_indices:
+                if num < 2:
                     continue
-                lines = data[num].split("\n")
-                for index, line in enumerate(lines):
-                    if " Z" in line and self.getValue(line, "Z") is not None:
-                        cur_z = float(self.getValue(line, "Z"))
-                        layer_hgt = round(cur_z - prev_z, 2)
-                        # This is required for pause code that can produce large Z moves or relative moves.
-                        if layer_hgt < 0: layer_hgt = layer_height
-                        prev_z = cur_z
-                    if line.startswith(";LAYER:"):
-                        lines[index] = line + "\n;layer:" + str(layer_hgt)
-                data[num] = "\n".join(lines)
+                # Only the LAYER lines and the lines with a Z are needed so let the regex engine skip over the rest
+                layer = data[num]
+                pieces = []
+                last_end = 0
+                for match in _RE_Z_OR_LAYER.finditer(layer):
+                    if match.group(1) is not None:
+                        pieces.append(layer[last_end:match.end()] + "\n;layer:" + str(layer_hgt))
+                        last_end = match.end()
+                        continue
+                    try:
+                        cur_z = float(match.group(2))
+                    except ValueError:
+                        continue
+                    layer_hgt = round(cur_z - prev_z, 2)
+                    # This is required for pause code that can produce large Z moves or relative moves.
+                    if layer_hgt < 0: layer_hgt = layer_height
+                    prev_z = cur_z
+                pieces.append(layer[last_end:])
+                data[num] = "".join(pieces)
         elif z_hop_enabled:
             l_index = 0
-            for num in range(1, len(data) - 1):
-                # For one-at-a-time items in the data[list] that are not layers.
-                if re.search(";LAYER:", data[num]) is None:
-                    continue
+            for num in layer_indices:
                 lines = data[num].split("\n")
                 for index, line in enumerate(lines):
                     # In case another post processor added lines before the LAYER line.
-                    if re.search(";LAYER:", line) is not None:
+                    if ";LAYER:" in line:
                         l_index = index
                     # Track the Z so the actual layer height can be determined
-                    if re.search("G1 Z(\d.*) F(\d.*)", line) is not None:
-                        cur_z = self.getValue(line, "Z")
+                    if _RE_G1_ZF.search(line) is not None:
+                        cur_z = parse_params(line).get("Z")
                         continue
                     if line.startswith("G1") and " X" in line and " Y" in line and " Z" in line:
-                        cur_z = self.getValue(line, "Z")
+                        cur_z = parse_params(line).get("Z")
                         continue
                     if line.startswith("G1") and " X" in line and " Y" in line and " E" in line:
                         if "\n" not in lines[l_index]:
@@ -239,11 +244,57 @@ class MarlinToFlashForgeConverter(Script):
                 data[num] = "\n".join(lines)
         return data
 
-    def _get_comment(self, c_line: str) -> str:
-        frt_part = c_line.split(";")[0]
-        frt_len = len(frt_part)
-        frt_part = frt_part.rstrip()
-        frt_2_len = len(frt_part)
-        spaces = frt_len - frt_2_len
-        c_comment = (" " * spaces) + ";" + c_line.split(";")[1]
-        return c_comment
\ No newline at end of file
+    def _mark_supports(self, layer: str) -> str:
+        # Flash Print wants each support section between 'support-start' and 'support-end' lines.  A section ends at the next comment line.
+        pieces = []
+        copied_to = 0
+        type_idx = layer.find(";TYPE:SUPPORT")
+        while type_idx != -1:
+            line_end = layer.find("\n", type_idx)
+            if line_end == -1:
+                line_end = len(layer)
+            if type_idx == 0 or layer[type_idx - 1] == "\n":
+                if layer.startswith(";TYPE:SUPPORT-INTERFACE", type_idx):
+                    structure = ";support-start\n;structure:line-support-solid"
+                else:
+                    structure = ";support-start\n;structure:line-support-sparse"
+                pieces.append(layer[copied_to:type_idx] + structure)
+                copied_to = line_end
+                end_idx = layer.find("\n;", line_end)
+                if end_idx != -1:
+                    pieces.append(layer[copied_to:end_idx + 1] + ";support-end\n")
+                    copied_to = end_idx + 1
+            type_idx = layer.find(";TYPE:SUPPORT", line_end)
+        pieces.append(layer[copied_to:])
+        return "".join(pieces)
+
+    def _g0_feedrate(self, match) -> str:
+        # Keep track of the feedrate on the lines that have one and add it to the G0's that don't
+        if match.group(1) is not None:
+            self._cur_feedrate = match.group(1)
+            return match.group(0)
+        return f"G1 F{self._cur_feedrate}"
+
+    def _parse_params(self, line: str) -> dict:
+        # Split the command part of the line into its parameters once rather than calling getValue for each one.
+        # The values are numbers the same as getValue would return.
+        params = {}
+        for word in line.split(";", 1)[0].split():
+            if word[0] in params:
+                continue
+            try:
+                params[word[0]] = int(word[1:])
+            except ValueError:
+                try:
+                    params[word[0]] = float(word[1:])
+                except ValueError:
+                    pass
+        return params
+
+    def _get_comment(self, c_line: str, semi_idx: int) -> str:
+        # 'semi_idx' is the index of the first semicolon which the caller has already found.
+        # Keep the spaces in front of the semicolon
+        frt_end = semi_idx
+        while frt_end > 0 and c_line[frt_end - 1] == " ":
+            frt_end -= 1
+        return c_line[frt_end:semi_idx] + ";" + c_line[semi_idx + 1:]
\ No newline at end of file
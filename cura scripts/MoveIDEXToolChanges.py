@@ -30,24 +30,26 @@ class MoveIDEXToolChanges(Script):
         }"""
 
     def execute(self, data):
-        if not bool(Application.getInstance().getGlobalContainerStack().getProperty("prime_tower_enable", "value")):
+        curaApp = Application.getInstance().getGlobalContainerStack()
+        if not bool(curaApp.getProperty("prime_tower_enable", "value")):
             Message(title = "[Move Tool Changes]", text = "Did not run because 'Prime Tower' is not enabled.").show()
             return data
-        machine_extruder_count = int(Application.getInstance().getGlobalContainerStack().getProperty("machine_extruder_count", "value"))
+        machine_extruder_count = int(curaApp.getProperty("machine_extruder_count", "value"))
         if machine_extruder_count < 2:
             return data
         start_index = 2
         for num in range(2, len(data) - 1):
-            if ";LAYER:0" in data[num]:
+            # Match the whole marker line.  A bare substring test would also match a longer layer number that starts with the same digits.
+            if data[num].startswith(";LAYER:0\n") or data[num].find("\n;LAYER:0\n") != -1:
                 start_index = num + 1
                 break
         
-        pull_lines = ""
-        prime_size = Application.getInstance().getGlobalContainerStack().getProperty("prime_tower_size", "value")
-        prime_x = Application.getInstance().getGlobalContainerStack().getProperty("prime_tower_position_x", "value") - prime_size / 2
-        prime_y = Application.getInstance().getGlobalContainerStack().getProperty("prime_tower_position_y", "value") + prime_size / 2
-        prime_feed = Application.getInstance().getGlobalContainerStack().getProperty("speed_prime_tower", "value") * 60
-        extruder = Application.getInstance().getGlobalContainerStack().extruderList
+        pull_lines = []
+        prime_size = curaApp.getProperty("prime_tower_size", "value")
+        prime_x = curaApp.getProperty("prime_tower_position_x", "value") - prime_size / 2
+        prime_y = curaApp.getProperty("prime_tower_position_y", "value") + prime_size / 2
+        prime_feed = curaApp.getProperty("speed_prime_tower", "value") * 60
+        extruder = curaApp.extruderList
         if extruder[0].getProperty("retraction_hop_after_extruder_switch", "value"):
             paste_line = 1
         else:
@@ -59,28 +61,31 @@ class MoveIDEXToolChanges(Script):
                 if ";TYPE:SKIRT" in data[num] or ";TYPE:BRIM" in data[num]:
                     continue
                 lines = data[num].split("\n")
-                modified_data = ""
+                modified_data = []
                 for index, line in enumerate(lines):
-                    if line.startswith("M135") or line.startswith("T"):
-                        pull_lines = f"\nG92 E0\nG0 F{prime_feed} X{prime_x} Y{prime_y}"
+                    if line.startswith(("M135", "T")):
+                        pull_lines = ["G92 E0", f"G0 F{prime_feed} X{prime_x} Y{prime_y}"]
                         p_index = index
                         # Pull out the lines before the travel moves to the prime tower
-                        while not lines[p_index].startswith(";") and not " Z" in lines[p_index]:
-                            pull_lines += "\n" + lines[p_index]
-                            lines.pop(p_index)   
+                        p_end = p_index
+                        while p_end < len(lines) and not lines[p_end].startswith(";") and not " Z" in lines[p_end]:
+                            p_end += 1
+                        if p_end > p_index:
+                            pull_lines.extend(lines[p_index:p_end])
+                            del lines[p_index:p_end]
                         if lines[p_index].startswith("G0 F") and " Z" in lines[p_index]:
-                            modified_data += lines[p_index] + "\n"
+                            modified_data.append(lines[p_index])
                             continue
                     # For situations where there is no MESH:NONMESH line
-                        if lines[p_index].startswith(";TYPE:") and pull_lines != "":
-                            lines[p_index] += pull_lines
-                            modified_data += lines[p_index] + "\n"
+                        if lines[p_index].startswith(";TYPE:") and pull_lines:
+                            lines[p_index] += "\n" + "\n".join(pull_lines)
+                            modified_data.append(lines[p_index])
                         continue
                     # Add the pulled_lines back in after TYPE:PRIME-TOWER
-                    if line.startswith(";TYPE:PRIME-TOWER") and pull_lines != "":
-                        lines[index + paste_line] += pull_lines
-                        pull_lines = ""
-                    modified_data += lines[index] + "\n"
-                data[num] = modified_data[:-1]
+                    if line.startswith(";TYPE:PRIME-TOWER") and pull_lines:
+                        lines[index + paste_line] += "\n" + "\n".join(pull_lines)
+                        pull_lines = []
+                    modified_data.append(lines[index])
+                data[num] = "\n".join(modified_data)
         return data
         
\ No newline at end of file
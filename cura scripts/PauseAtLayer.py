@@ -27,359 +27,438 @@
 
 from ..Script import Script
 import re
+import json
+from collections import namedtuple
 from UM.Application import Application
 from UM.Logger import Logger
 from typing import List, Tuple
 from UM.Message import Message
 
+# The first G0-G3 move in a layer that has both an X and a Y (ahead of any comment)
+_XY_RE = re.compile(r"^G[0-3]\b[^\n;]*?\sX(-?\d*\.?\d+)[^\n;]*?\sY(-?\d*\.?\d+)", re.MULTILINE)
+
+# The first letter of each command in the custom gcode strings (with any spaces in front of it)
+_CMD_CAP_RE = re.compile(r"(^|,)\s*([a-z])")
+
+# The print temperature commands
+_TEMP_PREFIXES = ("M109 S", "M104 S")
+
+# The commands that can have an X and a Y
+_MOVE_CMDS = frozenset(("G0", "G1", "G2", "G3"))
+
+# The number on a ";LAYER:" line
+_LAYER_NR_RE = re.compile(r"^;LAYER:(-?\d+)$", re.MULTILINE)
+
+# The same for renumbering.  The copy of the previous layer in front of a redo layer has a comment after the number, which goes when it is renumbered.
+_LAYER_RENUM_RE = re.compile(r"^;LAYER:(-?\d+)(?:[^\S\n]*;[^\n]*)?$", re.MULTILINE)
+
+# A retraction (or prime) line that has only a feed rate and an E value, or a firmware retraction
+_RETRACT_ANY_RE = re.compile(r"G1 F\d+(?:\.\d+)? E-?\d|G10")
+
+# The number on a ";LAYER_COUNT:" line
+_LAYER_COUNT_RE = re.compile(r";LAYER_COUNT:(\d*)")
+
+# The lines that are moved to the end of each section when the layers are renumbered, and the blank lines they leave behind
+_TIME_LINE_RE = re.compile(r"^(?:;TIME_ELAPSED:|;LAYER_COUNT:)[^\n]*", re.MULTILINE)
+_BLANK_LINES_RE = re.compile(r"\n{2,}")
+
+# The text after ";LAYER:" on a layer line, the print temperature lines and the gcode lines that have a Z.  These are used to skip the
+# layers in front of the pause without going through them line by line.
+_LAYER_LINE_RE = re.compile(r"^;LAYER:([^\n]*)", re.MULTILINE)
+_TEMP_LINE_RE = re.compile(r"^M10[49] S[^\n]*", re.MULTILINE)
+_Z_LINE_RE = re.compile(r"^[^;\n]*[^\S\n]Z-?\d*\.?\d+(?=[\s;]|$)[^\n]*", re.MULTILINE)
+
+# A gcode line that has an E value
+_E_LINE_RE = re.compile(r"^(?:[^;\n]*?[^\S\n])?E-?\d*\.?\d+[^\n]*", re.MULTILINE)
+
+# A tool change line
+_TOOL_LINE_RE = re.compile(r"^T[^\n]*", re.MULTILINE)
+
+# The settings that are the same for every pause
+_PauseCfg = namedtuple("_PauseCfg", [
+    "extruder_count",
+    "hold_steppers_on",
+    "disarm_timeout",
+    "reason_for_pause",
+    "unload_amount",
+    "unload_quick_purge",
+    "unload_reload_speed",
+    "reload_amount",
+    "purge_amount",
+    "extra_prime_amount",
+    "park_enabled",
+    "park_x",
+    "park_y",
+    "move_z",
+    "min_purge_clearance",
+    "redo_layer",
+    "redo_layer_flow",
+    "redo_layer_flow_reset",
+    "resume_temperature_cmd",
+    "standby_temperature",
+    "use_tool_temperature",
+    "resume_print_temperature",
+    "firmware_retract",
+    "control_temperatures",
+    "initial_layer_height",
+    "layer_height",
+    "z_hop_enabled",
+    "z_hop_height",
+    "gcode_before",
+    "gcode_after",
+    "beep_at_pause",
+    "beep_length",
+    "g4_dwell_time",
+    "pause_method",
+    "custom_pause_command"])
+
+# The parts of the pause gcode that are the same for every pause
+_PauseTemplate = namedtuple("_PauseTemplate", [
+    "pause_command",
+    "unload_gcode",
+    "hold_steppers_gcode",
+    "beep_gcode",
+    "relative_extrusion",
+    "extrusion_mode_string",
+    "extrusion_mode_numeric"])
+
+# The script settings
+_SETTINGS = {
+    "name": "Pause at Layer",
+    "key": "PauseAtLayer",
+    "metadata": {},
+    "version": 2,
+    "settings": {
+        "enable_pause_at_layer": {
+            "label": "Enable Pause at Layer",
+            "description": "When disabled it will remain in the post-processor list but will not run.",
+            "type": "bool",
+            "default_value": True,
+            "enabled": True
+        },
+        "pause_layer": {
+            "label": "Pause at end of layer...",
+            "description": "Enter the number of the LAST layer you want to finish prior to the pause. Use the layer numbers from the Cura preview.  If you want to use these exact same settings for more than one pause then use a comma to delimit the layer numbers.  If the settings are different then you must add another instance of PauseAtLayer.",
+            "type": "str",
+            "value": "25",
+            "minimum_value": "1",
+            "enabled": "enable_pause_at_layer"
+        },
+        "pause_method": {
+            "label": "Pause Command",
+            "description": "The gcode command to use to pause the print.  This is firmware dependent.  'M0 w/message(Marlin)' is firmware dependent but may show the LCD message if there is one.  'M0 (Marlin)' is the plain 'M0' command",
+            "type": "enum",
+            "options": {
+                "marlin": "M0 w/message(Marlin)",
+                "marlin2": "M0 (Marlin)",
+                "griffin": "M0 (Griffin,firmware retract)",
+                "bq": "M25 (BQ)",
+                "reprap": "M226 (RepRap)",
+                "repetier": "@pause (Repet/Octo)",
+                "alt_octo": "M125 (alt Octo)",
+                "raise_3d": "M2000 (raise3D)",
+                "klipper": "PAUSE (Klipper)",
+                "g_4": "G4 (dwell)",
+                "custom": "Custom Command"
+            },
+            "default_value": "marlin",
+            "enabled": "enable_pause_at_layer"
+        },
+        "g4_dwell_time": {
+            "label": "    G4 dwell time (in minutes)",
+            "description": "The amount of time to pause for. 'G4 S' is a 'hard' number.  You cannot make it shorter at the printer.  At the end of the dwell time - the printer will restart by itself.",
+            "type": "float",
+            "default_value": 5.0,
+            "minimum_value": 0.5,
+            "maximum_value_warning": 30.0,
+            "unit": "minutes   ",
+            "enabled": "enable_pause_at_layer and pause_method == 'g_4'"
+        },
+        "custom_pause_command": {
+            "label": "    Custom Pause Command",
+            "description": "If none of the the stock options work with your printer you can enter a custom command here.  If you use 'M600' for the filament change you must include any other parameters.  Check the gcode carefully.",
+            "type": "str",
+            "default_value": "",
+            "enabled": "enable_pause_at_layer and pause_method == 'custom'"
+        },
+        "reason_for_pause": {
+            "label": "Reason for Pause",
+            "description": "Filament changes allow for the unload / load / purge sequence.  Other reasons (Ex: inserting nuts or magnets) don't require those.",
+            "type": "enum",
+            "options": {
+                "reason_filament": "Filament Change",
+                "reason_other": "All Others"
+            },
+            "default_value": "reason_filament",
+            "enabled": "enable_pause_at_layer"
+        },
+        "one_at_a_time_renum": {
+            "label": "One-at-a-Time mode: Add pauses to all models",
+            "description": "When using 'One_at_a_Time' mode you can add pauses to each model.  Use the Cura preview layer numbers from the bottom through to the top.  Your model may be 150 layers tall and the pauses may be at '100,200,300' per the preview layer numbers.  Check the gcode to insure you get what you intended.  It is possible to give each model a pause at a different height (layer) or don't pause for some models.",
+            "type": "bool",
+            "default_value": False,
+            "enabled": "enable_pause_at_layer and pause_method != 'griffin'"
+        },
+        "unload_amount": {
+            "label": "     Unload Amount",
+            "description": "How much filament must be retracted to unload for the filament change.  This number will be split into segments in the gcode as a single command might trip the 'excessive extrusion' warning in the firmware.",
+            "unit": "mm   ",
+            "type": "int",
+            "value": 430,
+            "default_value": 0,
+            "enabled": "enable_pause_at_layer and pause_method != 'griffin' and reason_for_pause == 'reason_filament'"
+        },
+        "enable_quick_purge": {
+            "label": "    Quick purge before unload",
+            "description": "This can insure that the filament will unload by softening the tip so it can do the long retraction.  This purge is fixed length and will be 'retraction distance x 2.5' for bowden printers or 'retraction distance + 7' for direct drive printers.",
+            "type": "bool",
+            "default_value": True,
+            "enabled": "enable_pause_at_layer and pause_method != 'griffin' and reason_for_pause == 'reason_filament' and unload_amount > 0"
+        },
+        "unload_reload_speed": {
+            "label": "     Unload and Reload Speed",
+            "description": "How fast to unload or reload the filament in mm/sec.",
+            "unit": "mm/s   ",
+            "type": "int",
+            "value": 50,
+            "default_value": 50,
+            "enabled": "enable_pause_at_layer and pause_method not in ['griffin', 'repetier'] and reason_for_pause == 'reason_filament' and pause_at == 'layer_no'"
+        },
+        "reload_amount": {
+            "label": "     Reload Amount",
+            "description": "The length of filament to load before the purge.  90% of this distance will be fast and the final 10% at the purge speed.  If you prefer to reload up to the nozzle by hand then set this to '0'.",
+            "unit": "mm   ",
+            "type": "int",
+            "value": 370,
+            "default_value": 0,
+            "enabled": "enable_pause_at_layer and pause_method != 'griffin' and reason_for_pause == 'reason_filament'"
+        },
+        "purge_amount": {
+            "label": "     Purge Amount",
+            "description": "The amount of filament to be extruded after the pause. For most printers this is the amount to purge to complete a color change at the nozzle.  For Ultimaker2's this is to compensate for the retraction after the change. In that case 128+ is recommended.",
+            "unit": "mm   ",
+            "type": "int",
+            "value": 35,
+            "default_value": 35,
+            "enabled": "enable_pause_at_layer and pause_method != 'griffin' and reason_for_pause == 'reason_filament'"
+        },
+        "extra_prime_amount": {
+            "label": "Extra Prime Amount",
+            "description": "Sometimes a little more is needed to account for oozing during a pause.  At .2 layer height and .4 line width - 0.10mm of 1.75 filament of 'Extra Prime' is 3mm of extrusion.  0.10mm of 2.85 filament of 'Extra Prime' would be 8mm of extrusion.  Plan accordingly.",
+            "unit": "mm   ",
+            "type": "str",
+            "value": "0.30",
+            "default_value": "0.30",
+            "enabled": "enable_pause_at_layer and pause_method != 'griffin' and reason_for_pause == 'reason_other'"
+        },
+        "hold_steppers_on": {
+            "label": "Keep motors engaged",
+            "description": "Keep the steppers engaged so they don't lose position.  If this is unchecked then the Stepper Disarm time will be the default disarm time within the printer (often 2 minutes).",
+            "type": "bool",
+            "default_value": True,
+            "enabled": "enable_pause_at_layer and pause_method != 'griffin'"
+        },
+        "disarm_timeout": {
+            "label": "    Stepper disarm timeout",
+            "description": "After this amount of time (in minutes) the steppers will disarm (meaning that they will lose their positions). The behavior of a setting of '0' is dependent on the firmware.  It might mean 'disarm immediately' or 'never disarm'.  You would need to test it.",
+            "type": "int",
+            "default_value": 30,
+            "minimum_value": 0,
+            "maximum_value_warning": 120,
+            "unit": "minutes   ",
+            "enabled": "enable_pause_at_layer and hold_steppers_on and pause_method != 'griffin'"
+        },
+        "head_park_enabled": {
+            "label": "Park the PrintHead",
+            "description": "Move the head to a safe location when pausing (necessary for filament changes with nozzle purges, or just to move it out of the way to make insertions into the print). Leave this unchecked if your printer handles parking for you.",
+            "type": "bool",
+            "default_value": True,
+            "enabled": "enable_pause_at_layer and pause_method != 'griffin'"
+        },
+        "head_park_x": {
+            "label": "     Park PrintHead X",
+            "description": "What X location does the head move to when pausing.",
+            "unit": "mm   ",
+            "type": "float",
+            "maximum_value": 230,
+            "default_value": 0,
+            "enabled": "enable_pause_at_layer and head_park_enabled and pause_method != 'griffin'"
+        },
+        "head_park_y": {
+            "label": "     Park PrintHead Y",
+            "description": "What Y location does the head move to when pausing.",
+            "unit": "mm   ",
+            "type": "float",
+            "maximum_value": 230,
+            "default_value": 0,
+            "enabled": "enable_pause_at_layer and head_park_enabled and pause_method != 'griffin'"
+        },
+        "head_move_z": {
+            "label": "     Lift Head Z",
+            "description": "The relative move of the Z-axis above the print before parking.  If the Z ends up at less than 'Minimum Dist Nozzle to Plate' there will be a second move to provide room for purging below the nozzle (if you happen to be changing filament).",
+            "unit": "mm   ",
+            "type": "float",
+            "default_value": 1.0,
+            "minimum_value": 0.0,
+            "minimum_value_warning": 0.2,
+            "maximum_value_warning": 8,
+            "maximum_value": 10,
+            "enabled": "enable_pause_at_layer and head_park_enabled and pause_method != 'repetier'"
+        },
+        "min_purge_clearance": {
+            "label": "     Minimum dist nozzle to plate",
+            "description": "Pausing at a low layer might not leave enough room below the nozzle to purge.  The number you enter here will be used as the minimum Z height at the park position.  If your pause is at Z=8.4 and you enter 25 here then there will be a second Z move at the park position to move up to 25.",
+            "unit": "mm   ",
+            "type": "int",
+            "default_value": 15,
+            "minimum_value": 0,
+            "maximum_value": 50,
+            "enabled": "enable_pause_at_layer and head_park_enabled and pause_method != 'repetier'"
+        },
+        "standby_temperature": {
+            "label": "Standby Temperature",
+            "description": "The temperature to hold at during the pause.  If this temperature is different than your print temperature then use the 'M109' Resume Temperature Cmd option",
+            "unit": "°C   ",
+            "type": "int",
+            "default_value": 200,
+            "enabled": "enable_pause_at_layer and pause_method not in ['griffin', 'repetier']"
+        },
+        "tool_temp_overide_enable": {
+            "label": "Hidden setting Temp Overide Enable",
+            "description": "Enable tool changes to overide the print temperature.",
+            "type": "bool",
+            "default_value": False,
+            "enabled": False
+        },
+        "tool_temp_overide": {
+            "label": "Tool changes set resume temperature",
+            "description": "For multi-extruder printers - resume the print at the temperature of the current extruder.",
+            "type": "bool",
+            "default_value": False,
+            "enabled": "tool_temp_overide_enable and enable_pause_at_layer"
+        },
+        "resume_temperature_cmd": {
+            "label": "Resume Temperature Cmd",
+            "description": "If you switch materials, or if your standby temperature is different than the Resume Printing temperature then use M109.  If they happen to be the same you can use M104 and there won't be a wait period.",
+            "type": "enum",
+            "options": {
+                "m109_cmd": "M109",
+                "m104_cmd": "M104"
+            },
+            "default_value": "m104_cmd",
+            "enabled": "enable_pause_at_layer and pause_method not in ['griffin', 'repetier'] and not tool_temp_overide"
+        },
+        "resume_print_temperature": {
+            "label": "Resume Print Temperature",
+            "description": "The temperature to resume the print after the pause.  If this temperature is different than your standby temperature then use the 'M109' Resume Temperature Cmd option",
+            "unit": "°C   ",
+            "type": "int",
+            "default_value": 200,
+            "enabled": "enable_pause_at_layer and pause_method not in ['griffin', 'repetier'] and not tool_temp_overide"
+        },
+        "display_text": {
+            "label": "Message to LCD",
+            "description": "Text that should appear on the display while paused. If left empty, there will not be any message.  Please note:  It is possible that the message will be immediately overridden by another message sent by the firmware.  If 'M0 w/message' is chosen as the pause command then the message is added to the pause command. You may have as many messages as pauses.  Delimit with a comma",
+            "type": "str",
+            "default_value": "",
+            "enabled": "enable_pause_at_layer and pause_method != 'repetier'"
+        },
+        "custom_gcode_before_pause": {
+            "label": "G-code Before Pause",
+            "description": "Custom g-code to run before the pause. EX: M300 to beep. Use a comma to separate multiple commands. EX: M400,M300,M117 Pause",
+            "type": "str",
+            "default_value": "",
+            "enabled": "enable_pause_at_layer"
+        },
+        "beep_at_pause": {
+            "label": "Beep at pause",
+            "description": "Make an annoying sound when pausing",
+            "type": "bool",
+            "default_value": False,
+            "enabled": "enable_pause_at_layer"
+        },
+        "beep_length": {
+            "label": "Beep duration",
+            "description": "How long should the annoying sound last.  The units are in milliseconds so 1000 equals 1 second. ('250' is a quick chirp).",
+            "type": "int",
+            "default_value": "1000",
+            "unit": "msec   ",
+            "enabled": "enable_pause_at_layer and beep_at_pause"
+        },
+        "redo_layer": {
+            "label": "Redo Layer",
+            "description": "Redo the last layer before the pause, to get the filament flowing again after having oozed a bit during the pause.",
+            "type": "bool",
+            "default_value": False,
+            "enabled": "enable_pause_at_layer and reason_for_pause == 'reason_filament'"
+        },
+        "redo_layer_flow": {
+            "label": "     Flow Rate for Redo Layer",
+            "description": "You can adjust the Flow Rate of the 'Redo Layer' to help keep a layer from sticking out due to over-extrusion.  The flow will be reset to 100% at the end of the redo layer.",
+            "type": "int",
+            "default_value": 100,
+            "maximum_value": 150,
+            "minimum_value": 50,
+            "enabled": "enable_pause_at_layer and redo_layer and reason_for_pause == 'reason_filament'"
+        },
+        "custom_gcode_after_pause": {
+            "label": "G-code After Pause",
+            "description": "Custom g-code to run after the pause. Use a comma to separate multiple commands. EX: M204 X8 Y8,M106 S0,M999.  Some firmware that uses M25 to pause may need a buffer to avoid executing commands that are beyond the pause line.  You can use 'M105,M105,M105,M105,M105,M105' as a buffer.",
+            "type": "str",
+            "default_value": "",
+            "enabled": "enable_pause_at_layer"
+        },
+        "machine_name": {
+            "label": "Machine Type",
+            "description": "The name of your 3D printer model. This setting is controlled by the script and will not be visible.",
+            "default_value": "Unknown",
+            "type": "str",
+            "enabled": False
+        },
+        "machine_gcode_flavor": {
+            "label": "G-code flavor",
+            "description": "The type of g-code to be generated. This setting is controlled by the script and will not be visible.",
+            "type": "enum",
+            "options": {
+                "RepRap (Marlin/Sprinter)": "Marlin",
+                "RepRap (Volumetric)": "Marlin (Volumetric)",
+                "RepRap (RepRap)": "RepRap",
+                "UltiGCode": "Ultimaker 2",
+                "Griffin": "Griffin",
+                "Makerbot": "Makerbot",
+                "BFB": "Bits from Bytes",
+                "MACH3": "Mach3",
+                "Repetier": "Repetier"
+            },
+            "default_value": "RepRap (Marlin/Sprinter)",
+            "enabled": False
+        }
+    }
+}
+
+# The settings never change so the JSON is only built once
+_SETTING_DATA_STRING = json.dumps(_SETTINGS, separators = (",", ":"))
+
+# Split the command part of a line into its parameters once rather than looking each one up.  The command word is included
+# (a tool change comes back as "T"), the first of a repeated letter is kept, and the values are numbers the same as getValue would return.
+def _parse_params(line: str) -> dict:
+    params = {}
+    for word in line.split(";", 1)[0].split():
+        if word[0] in params:
+            continue
+        try:
+            params[word[0]] = int(word[1:])
+        except ValueError:
+            try:
+                params[word[0]] = float(word[1:])
+            except ValueError:
+                pass
+    return params
+
 class PauseAtLayer(Script):
 
     def getSettingDataString(self) -> str:
-        return """{
-            "name": "Pause at Layer",
-            "key": "PauseAtLayer",
-            "metadata": {},
-            "version": 2,
-            "settings":
-            {
-                "enable_pause_at_layer":
-                {
-                    "label": "Enable Pause at Layer",
-                    "description": "When disabled it will remain in the post-processor list but will not run.",
-                    "type": "bool",
-                    "default_value": true,
-                    "enabled": true
-                },
-                "pause_layer":
-                {
-                    "label": "Pause at end of layer...",
-                    "description": "Enter the number of the LAST layer you want to finish prior to the pause. Use the layer numbers from the Cura preview.  If you want to use these exact same settings for more than one pause then use a comma to delimit the layer numbers.  If the settings are different then you must add another instance of PauseAtLayer.",
-                    "type": "str",
-                    "value": "25",
-                    "minimum_value": "1",
-                    "enabled": "enable_pause_at_layer"
-                },
-                "pause_method":
-                {
-                    "label": "Pause Command",
-                    "description": "The gcode command to use to pause the print.  This is firmware dependent.  'M0 w/message(Marlin)' is firmware dependent but may show the LCD message if there is one.  'M0 (Marlin)' is the plain 'M0' command",
-                    "type": "enum",
-                    "options": {
-                        "marlin": "M0 w/message(Marlin)",
-                        "marlin2": "M0 (Marlin)",
-                        "griffin": "M0 (Griffin,firmware retract)",
-                        "bq": "M25 (BQ)",
-                        "reprap": "M226 (RepRap)",
-                        "repetier": "@pause (Repet/Octo)",
-                        "alt_octo": "M125 (alt Octo)",
-                        "raise_3d": "M2000 (raise3D)",
-                        "klipper": "PAUSE (Klipper)",
-                        "g_4": "G4 (dwell)",
-                        "custom": "Custom Command"
-                        },
-                    "default_value": "marlin",
-                    "enabled": "enable_pause_at_layer"
-                },
-                "g4_dwell_time":
-                {
-                    "label": "    G4 dwell time (in minutes)",
-                    "description": "The amount of time to pause for. 'G4 S' is a 'hard' number.  You cannot make it shorter at the printer.  At the end of the dwell time - the printer will restart by itself.",
-                    "type": "float",
-                    "default_value": 5.0,
-                    "minimum_value": 0.5,
-                    "maximum_value_warning": 30.0,
-                    "unit": "minutes   ",
-                    "enabled": "enable_pause_at_layer and pause_method == 'g_4'"
-                },
-                "custom_pause_command":
-                {
-                    "label": "    Custom Pause Command",
-                    "description": "If none of the the stock options work with your printer you can enter a custom command here.  If you use 'M600' for the filament change you must include any other parameters.  Check the gcode carefully.",
-                    "type": "str",
-                    "default_value": "",
-                    "enabled": "enable_pause_at_layer and pause_method == 'custom'"
-                },
-                "reason_for_pause":
-                {
-                    "label": "Reason for Pause",
-                    "description": "Filament changes allow for the unload / load / purge sequence.  Other reasons (Ex: inserting nuts or magnets) don't require those.",
-                    "type": "enum",
-                    "options": {"reason_filament": "Filament Change", "reason_other": "All Others"},
-                    "default_value": "reason_filament",
-                    "enabled": "enable_pause_at_layer"
-                },
-                "one_at_a_time_renum":
-                {
-                    "label": "One-at-a-Time mode: Add pauses to all models",
-                    "description": "When using 'One_at_a_Time' mode you can add pauses to each model.  Use the Cura preview layer numbers from the bottom through to the top.  Your model may be 150 layers tall and the pauses may be at '100,200,300' per the preview layer numbers.  Check the gcode to insure you get what you intended.  It is possible to give each model a pause at a different height (layer) or don't pause for some models.",
-                    "type": "bool",
-                    "default_value": false,
-                    "enabled": "enable_pause_at_layer and pause_method != 'griffin'"
-                },
-                "unload_amount":
-                {
-                    "label": "     Unload Amount",
-                    "description": "How much filament must be retracted to unload for the filament change.  This number will be split into segments in the gcode as a single command might trip the 'excessive extrusion' warning in the firmware.",
-                    "unit": "mm   ",
-                    "type": "int",
-                    "value": 430,
-                    "default_value": 0,
-                    "enabled": "enable_pause_at_layer and pause_method != 'griffin' and reason_for_pause == 'reason_filament'"
-                },
-                "enable_quick_purge":
-                {
-                    "label": "    Quick purge before unload",
-                    "description": "This can insure that the filament will unload by softening the tip so it can do the long retraction.  This purge is fixed length and will be 'retraction distance x 2.5' for bowden printers or 'retraction distance + 7' for direct drive printers.",
-                    "type": "bool",
-                    "default_value": true,
-                    "enabled": "enable_pause_at_layer and pause_method != 'griffin' and reason_for_pause == 'reason_filament' and unload_amount > 0"
-                },
-                "unload_reload_speed":
-                {
-                    "label": "     Unload and Reload Speed",
-                    "description": "How fast to unload or reload the filament in mm/sec.",
-                    "unit": "mm/s   ",
-                    "type": "int",
-                    "value": 50,
-                    "default_value": 50,
-                    "enabled": "enable_pause_at_layer and pause_method not in ['griffin', 'repetier'] and reason_for_pause == 'reason_filament' and pause_at == 'layer_no'"
-                },
-                "reload_amount":
-                {
-                    "label": "     Reload Amount",
-                    "description": "The length of filament to load before the purge.  90% of this distance will be fast and the final 10% at the purge speed.  If you prefer to reload up to the nozzle by hand then set this to '0'.",
-                    "unit": "mm   ",
-                    "type": "int",
-                    "value": 370,
-                    "default_value": 0,
-                    "enabled": "enable_pause_at_layer and pause_method != 'griffin' and reason_for_pause == 'reason_filament'"
-                },
-                "purge_amount":
-                {
-                    "label": "     Purge Amount",
-                    "description": "The amount of filament to be extruded after the pause. For most printers this is the amount to purge to complete a color change at the nozzle.  For Ultimaker2's this is to compensate for the retraction after the change. In that case 128+ is recommended.",
-                    "unit": "mm   ",
-                    "type": "int",
-                    "value": 35,
-                    "default_value": 35,
-                    "enabled": "enable_pause_at_layer and pause_method != 'griffin' and reason_for_pause == 'reason_filament'"
-                },
-                "extra_prime_amount":
-                {
-                    "label": "Extra Prime Amount",
-                    "description": "Sometimes a little more is needed to account for oozing during a pause.  At .2 layer height and .4 line width - 0.10mm of 1.75 filament of 'Extra Prime' is 3mm of extrusion.  0.10mm of 2.85 filament of 'Extra Prime' would be 8mm of extrusion.  Plan accordingly.",
-                    "unit": "mm   ",
-                    "type": "str",
-                    "value": "0.30",
-                    "default_value": "0.30",
-                    "enabled": "enable_pause_at_layer and pause_method != 'griffin' and reason_for_pause == 'reason_other'"
-                },
-                "hold_steppers_on":
-                {
-                    "label": "Keep motors engaged",
-                    "description": "Keep the steppers engaged so they don't lose position.  If this is unchecked then the Stepper Disarm time will be the default disarm time within the printer (often 2 minutes).",
-                    "type": "bool",
-                    "default_value": true,
-                    "enabled": "enable_pause_at_layer and pause_method != 'griffin'"
-                },
-                "disarm_timeout":
-                {
-                    "label": "    Stepper disarm timeout",
-                    "description": "After this amount of time (in minutes) the steppers will disarm (meaning that they will lose their positions). The behavior of a setting of '0' is dependent on the firmware.  It might mean 'disarm immediately' or 'never disarm'.  You would need to test it.",
-                    "type": "int",
-                    "default_value": 30,
-                    "minimum_value": 0,
-                    "maximum_value_warning": 120,
-                    "unit": "minutes   ",
-                    "enabled": "enable_pause_at_layer and hold_steppers_on and pause_method != 'griffin'"
-                },
-                "head_park_enabled":
-                {
-                    "label": "Park the PrintHead",
-                    "description": "Move the head to a safe location when pausing (necessary for filament changes with nozzle purges, or just to move it out of the way to make insertions into the print). Leave this unchecked if your printer handles parking for you.",
-                    "type": "bool",
-                    "default_value": true,
-                    "enabled": "enable_pause_at_layer and pause_method != 'griffin'"
-                },
-                "head_park_x":
-                {
-                    "label": "     Park PrintHead X",
-                    "description": "What X location does the head move to when pausing.",
-                    "unit": "mm   ",
-                    "type": "float",
-                    "maximum_value": 230,
-                    "default_value": 0,
-                    "enabled": "enable_pause_at_layer and head_park_enabled and pause_method != 'griffin'"
-                },
-                "head_park_y":
-                {
-                    "label": "     Park PrintHead Y",
-                    "description": "What Y location does the head move to when pausing.",
-                    "unit": "mm   ",
-                    "type": "float",
-                    "maximum_value": 230,
-                    "default_value": 0,
-                    "enabled": "enable_pause_at_layer and head_park_enabled and pause_method != 'griffin'"
-                },
-                "head_move_z":
-                {
-                    "label": "     Lift Head Z",
-                    "description": "The relative move of the Z-axis above the print before parking.  If the Z ends up at less than 'Minimum Dist Nozzle to Plate' there will be a second move to provide room for purging below the nozzle (if you happen to be changing filament).",
-                    "unit": "mm   ",
-                    "type": "float",
-                    "default_value": 1.0,
-                    "minimum_value": 0.0,
-                    "minimum_value_warning": 0.2,
-                    "maximum_value_warning": 8,
-                    "maximum_value": 10,
-                    "enabled": "enable_pause_at_layer and head_park_enabled and pause_method != 'repetier'"
-                },
-                "min_purge_clearance":
-                {
-                    "label": "     Minimum dist nozzle to plate",
-                    "description": "Pausing at a low layer might not leave enough room below the nozzle to purge.  The number you enter here will be used as the minimum Z height at the park position.  If your pause is at Z=8.4 and you enter 25 here then there will be a second Z move at the park position to move up to 25.",
-                    "unit": "mm   ",
-                    "type": "int",
-                    "default_value": 15,
-                    "minimum_value": 0,
-                    "maximum_value": 50,
-                    "enabled": "enable_pause_at_layer and head_park_enabled and pause_method != 'repetier'"
-                },
-
-                "standby_temperature":
-                {
-                    "label": "Standby Temperature",
-                    "description": "The temperature to hold at during the pause.  If this temperature is different than your print temperature then use the 'M109' Resume Temperature Cmd option",
-                    "unit": "°C   ",
-                    "type": "int",
-                    "default_value": 200,
-                    "enabled": "enable_pause_at_layer and pause_method not in ['griffin\', 'repetier']"
-                },
-                "tool_temp_overide_enable":
-                {
-                    "label": "Hidden setting Temp Overide Enable",
-                    "description": "Enable tool changes to overide the print temperature.",
-                    "type": "bool",
-                    "default_value": false,
-                    "enabled": false
-                },
-                "tool_temp_overide":
-                {
-                    "label": "Tool changes set resume temperature",
-                    "description": "For multi-extruder printers - resume the print at the temperature of the current extruder.",
-                    "type": "bool",
-                    "default_value": false,
-                    "enabled": "tool_temp_overide_enable and enable_pause_at_layer"
-                },
-                "resume_temperature_cmd":
-                {
-                    "label": "Resume Temperature Cmd",
-                    "description": "If you switch materials, or if your standby temperature is different than the Resume Printing temperature then use M109.  If they happen to be the same you can use M104 and there won't be a wait period.",
-                    "type": "enum",
-                    "options": {
-                        "m109_cmd": "M109",
-                        "m104_cmd": "M104"},
-                    "default_value": "m104_cmd",
-                    "enabled": "enable_pause_at_layer and pause_method not in ['griffin', 'repetier'] and not tool_temp_overide"
-                },
-                "resume_print_temperature":
-                {
-                    "label": "Resume Print Temperature",
-                    "description": "The temperature to resume the print after the pause.  If this temperature is different than your standby temperature then use the 'M109' Resume Temperature Cmd option",
-                    "unit": "°C   ",
-                    "type": "int",
-                    "default_value": 200,
-                    "enabled": "enable_pause_at_layer and pause_method not in ['griffin\', 'repetier'] and not tool_temp_overide"
-                },
-                "display_text":
-                {
-                    "label": "Message to LCD",
-                    "description": "Text that should appear on the display while paused. If left empty, there will not be any message.  Please note:  It is possible that the message will be immediately overridden by another message sent by the firmware.  If 'M0 w/message' is chosen as the pause command then the message is added to the pause command. You may have as many messages as pauses.  Delimit with a comma",
-                    "type": "str",
-                    "default_value": "",
-                    "enabled": "enable_pause_at_layer and pause_method != 'repetier'"
-                },
-                "custom_gcode_before_pause":
-                {
-                    "label": "G-code Before Pause",
-                    "description": "Custom g-code to run before the pause. EX: M300 to beep. Use a comma to separate multiple commands. EX: M400,M300,M117 Pause",
-                    "type": "str",
-                    "default_value": "",
-                    "enabled": "enable_pause_at_layer"
-                },
-                "beep_at_pause":
-                {
-                    "label": "Beep at pause",
-                    "description": "Make an annoying sound when pausing",
-                    "type": "bool",
-                    "default_value": false,
-                    "enabled": "enable_pause_at_layer"
-                },
-                "beep_length":
-                {
-                    "label": "Beep duration",
-                    "description": "How long should the annoying sound last.  The units are in milliseconds so 1000 equals 1 second. ('250' is a quick chirp).",
-                    "type": "int",
-                    "default_value": "1000",
-                    "unit": "msec   ",
-                    "enabled": "enable_pause_at_layer and beep_at_pause"
-                },
-                "redo_layer":
-                {
-                    "label": "Redo Layer",
-                    "description": "Redo the last layer before the pause, to get the filament flowing again after having oozed a bit during the pause.",
-                    "type": "bool",
-                    "default_value": false,
-                    "enabled": "enable_pause_at_layer and reason_for_pause == 'reason_filament'"
-                },
-                "redo_layer_flow":
-                {
-                    "label": "     Flow Rate for Redo Layer",
-                    "description": "You can adjust the Flow Rate of the 'Redo Layer' to help keep a layer from sticking out due to over-extrusion.  The flow will be reset to 100% at the end of the redo layer.",
-                    "type": "int",
-                    "default_value": 100,
-                    "maximum_value": 150,
-                    "minimum_value": 50,
-                    "enabled": "enable_pause_at_layer and redo_layer and reason_for_pause == 'reason_filament'"
-                },
-                "custom_gcode_after_pause":
-                {
-                    "label": "G-code After Pause",
-                    "description": "Custom g-code to run after the pause. Use a comma to separate multiple commands. EX: M204 X8 Y8,M106 S0,M999.  Some firmware that uses M25 to pause may need a buffer to avoid executing commands that are beyond the pause line.  You can use 'M105,M105,M105,M105,M105,M105' as a buffer.",
-                    "type": "str",
-                    "default_value": "",
-                    "enabled": "enable_pause_at_layer"
-                },
-                "machine_name":
-                {
-                    "label": "Machine Type",
-                    "description": "The name of your 3D printer model. This setting is controlled by the script and will not be visible.",
-                    "default_value": "Unknown",
-                    "type": "str",
-                    "enabled": false
-                },
-                "machine_gcode_flavor":
-                {
-                    "label": "G-code flavor",
-                    "description": "The type of g-code to be generated. This setting is controlled by the script and will not be visible.",
-                    "type": "enum",
-                    "options":
-                    {
-                        "RepRap (Marlin/Sprinter)": "Marlin",
-                        "RepRap (Volumetric)": "Marlin (Volumetric)",
-                        "RepRap (RepRap)": "RepRap",
-                        "UltiGCode": "Ultimaker 2",
-                        "Griffin": "Griffin",
-                        "Makerbot": "Makerbot",
-                        "BFB": "Bits from Bytes",
-                        "MACH3": "Mach3",
-                        "Repetier": "Repetier"
-                    },
-                    "default_value": "RepRap (Marlin/Sprinter)",
-                    "enabled": false
-                }
-            }
-        }"""
+        return _SETTING_DATA_STRING
 
     #  Get the machine name and gcode flavor so we can use their value in the script stack
     def initialize(self) -> None:
@@ -389,16 +468,16 @@ class PauseAtLayer(Script):
         if curaApp is None or self._instance is None:
             return
 
-        for key in ["machine_name", "machine_gcode_flavor"]:
-            self._instance.setProperty(key, "value", curaApp.getProperty(key, "value"))
+        self._instance.setProperty("machine_name", "value", curaApp.getProperty("machine_name", "value"))
+        self._instance.setProperty("machine_gcode_flavor", "value", curaApp.getProperty("machine_gcode_flavor", "value"))
         extruder = curaApp.extruderList
         machine_extruder_count = int(curaApp.getProperty("machine_extruder_count", "value"))
         self._instance.setProperty("tool_temp_overide_enable", "value", machine_extruder_count > 1)
         self._instance.setProperty("tool_temp_overide", "value", machine_extruder_count > 1)
-        standby_temperature = extruder[0].getProperty("material_print_temperature", "value")
-        self._instance.setProperty("standby_temperature", "value", standby_temperature)
-        resume_print_temperature = extruder[0].getProperty("material_print_temperature", "value")
-        self._instance.setProperty("resume_print_temperature", "value", resume_print_temperature)
+        # The standby and resume temperatures both start at the print temperature
+        print_temperature = extruder[0].getProperty("material_print_temperature", "value")
+        self._instance.setProperty("standby_temperature", "value", print_temperature)
+        self._instance.setProperty("resume_print_temperature", "value", print_temperature)
         unload_reload_speed = int(curaApp.getProperty("machine_max_feedrate_e", "value"))
         # If Cura has the max E speed at 299792458000 knock it down to something reasonable
         if unload_reload_speed > 100: unload_reload_speed = 100
@@ -411,44 +490,76 @@ class PauseAtLayer(Script):
 
     def execute(self, data):
         if not self.getSettingValueByKey("enable_pause_at_layer"):
-            data[0] += ";    [Pause At Layer] Not enabled\n"
+            Logger.log("i", "[Pause At Layer] Is not enabled.")
             return data
         curaApp = Application.getInstance().getGlobalContainerStack()
         extruder_count = int(curaApp.getProperty("machine_extruder_count", "value"))
         one_at_a_time = curaApp.getProperty("print_sequence", "value")
         one_at_a_time_renum = bool(self.getSettingValueByKey("one_at_a_time_renum"))
+        self._renum_map = {}
         if one_at_a_time == "one_at_a_time" and one_at_a_time_renum:
             data = self._renumber_layers(data, "renum")
         pause_layer_setting = str(self.getSettingValueByKey("pause_layer"))
         display_text = str(self.getSettingValueByKey("display_text"))
         pause_layer_list = pause_layer_setting.split(",")
         display_text_list = display_text.split(",")
+        last_msg_idx = len(display_text_list) - 1
+        cfg = self._get_pause_cfg()
+        template = self._build_pause_template(cfg)
+        layer_index = self._index_layers(data) if extruder_count > 1 else {}
         for index, pause_layer in enumerate(pause_layer_list):
             self.tool_nr = 0
             if extruder_count > 1:
-                self.tool_nr = self._track_tool_nr(data, pause_layer)
+                self.tool_nr = self._track_tool_nr(data, layer_index.get(int(pause_layer.strip()), 0))
             self._get_tool_settings(self.tool_nr)
-            try:
-                txt_msg = display_text_list[index]
-            except:
-                txt_msg = display_text_list[len(display_text_list) - 1]
-            data = self._find_pause(data, int(pause_layer.strip()), txt_msg.strip())
+            # If there are more pauses than messages then the last message is used for the rest of the pauses
+            txt_msg = display_text_list[min(index, last_msg_idx)]
+            data = self._find_pause(data, int(pause_layer.strip()), txt_msg.strip(), cfg, template)
+            # A redo layer renumbers the layers so the index has to be rebuilt
+            if cfg.redo_layer and extruder_count > 1:
+                layer_index = self._index_layers(data)
         if one_at_a_time == "one_at_a_time" and one_at_a_time_renum:
             data = self._renumber_layers(data, "un_renum")
         return data
 
     #  Get the X and Y values for a layer (will be used to get X and Y of the layer after the pause and of the 'redo' layer if that option is used).
     def getNextXY(self, layer: str) -> Tuple[float, float]:
-        lines = layer.split("\n")
-        for line in lines:
-            if line.startswith(("G0", "G1", "G2", "G3")):
-                if self.getValue(line, "X") is not None and self.getValue(line, "Y") is not None:
-                    x = self.getValue(line, "X")
-                    y = self.getValue(line, "Y")
-                    return x, y
-        return 0, 0
-
-    def _find_pause(self, new_data: [str], pause_layer: int, txt_msg: str) -> [str]:
+        # Search for the first move that has both an X and a Y rather than going line by line.  It is almost always near the start
+        # of the layer so the first 4K (cut back to a whole line) is tried before the whole layer.
+        head_end = layer.rfind("\n", 0, 4096)
+        match = _XY_RE.search(layer, 0, head_end) if head_end != -1 else None
+        if match is None:
+            match = _XY_RE.search(layer)
+        if match is None:
+            return 0, 0
+        params = _parse_params(match.group(0))
+        return params["X"], params["Y"]
+
+    # Give the lines of a layer from the last one to the first one.  The layer is walked backwards with rfind so no list of lines is made
+    # and nothing past the line the caller stops at is looked at.
+    def _reversed_lines(self, layer: str):
+        end = len(layer)
+        while True:
+            start = layer.rfind("\n", 0, end) + 1
+            yield layer[start:end]
+            if start == 0:
+                return
+            end = start - 1
+
+    # The custom commands are entered as a comma delimited list.  Capitalize the command letters and put each command on its own line.
+    def _normalize_custom_gcode(self, gcode: str) -> str:
+        return _CMD_CAP_RE.sub(lambda m: m.group(1) + m.group(2).upper(), gcode).replace(",", "\n")
+
+    # Break a long extrusion into full 150mm chunks and a remainder.  The remainder is always more than 0 and no more than 150.
+    def _split_150(self, amount) -> Tuple[int, float]:
+        chunks, remainder = divmod(amount, 150)
+        if remainder == 0:
+            chunks -= 1
+            remainder = 150
+        return int(chunks), remainder
+
+    # Read the settings that are the same for every pause.  This is done once in 'execute' instead of once per pause.
+    def _get_pause_cfg(self) -> _PauseCfg:
         curaApp = Application.getInstance().getGlobalContainerStack()
         extruder = curaApp.extruderList
         extruder_count = int(curaApp.getProperty("machine_extruder_count", "value"))
@@ -463,16 +574,14 @@ class PauseAtLayer(Script):
         extra_prime_amount = self.getSettingValueByKey("extra_prime_amount")
         if reason_for_pause == "reason_filament":
             extra_prime_amount = "0"
-        purge_speed = round(self.nozzle_size * 500) # calculate the purge speed based on the nozzle size.  A 0.4 will be 200 and a 0.8 will be 400 mm/min.
         park_enabled = self.getSettingValueByKey("head_park_enabled")
         park_x = self.getSettingValueByKey("head_park_x") if self.getSettingValueByKey("head_park_x") < self._machine_depth else self._machine_depth
         park_y = self.getSettingValueByKey("head_park_y") if self.getSettingValueByKey("head_park_y") < self._machine_width else self._machine_width
         move_z = self.getSettingValueByKey("head_move_z")
         min_purge_clearance = self.getSettingValueByKey("min_purge_clearance")
-        layers_started = False
         redo_layer = self.getSettingValueByKey("redo_layer")
         if redo_layer and reason_for_pause == "reason_filament":
-            redo_layer_flow = "M221 S" + str(self.getSettingValueByKey("redo_layer_flow")) + str(" " * (27 - len("M221 S" + str(self.getSettingValueByKey("redo_layer_flow"))))) + "; Set Redo Layer Flow Rate"
+            redo_layer_flow = f"{'M221 S' + str(self.getSettingValueByKey('redo_layer_flow')):<27}; Set Redo Layer Flow Rate"
             redo_layer_flow_reset = "M221 S100                  ; End of Redo Layer - Reset Flow Rate\n"
         else:
             redo_layer_flow = ""
@@ -485,32 +594,15 @@ class PauseAtLayer(Script):
         firmware_retract = curaApp.getProperty("machine_firmware_retract", "value")
         control_temperatures = curaApp.getProperty("machine_nozzle_temp_enabled", "value")
         initial_layer_height = curaApp.getProperty("layer_height_0", "value")
-        self.layer_height = curaApp.getProperty("layer_height", "value")
-        self.z_hop_enabled = extruder[0].getProperty("retraction_hop_enabled", "value")
-        if self.z_hop_enabled:
-            self.z_hop_height = extruder[0].getProperty("retraction_hop", "value")
+        layer_height = curaApp.getProperty("layer_height", "value")
+        z_hop_enabled = extruder[0].getProperty("retraction_hop_enabled", "value")
+        if z_hop_enabled:
+            z_hop_height = extruder[0].getProperty("retraction_hop", "value")
         else:
-            self.z_hop_height = 0
-        display_text = txt_msg
+            z_hop_height = 0
         # Capitalize the command letter of any added commands.  Some firmware doesn't acknowledge lower case commands.
-        gcode_before = self.getSettingValueByKey("custom_gcode_before_pause")
-        if gcode_before != "":
-            if "," in gcode_before:
-                xtra_cmds = gcode_before.split(",")
-                for index in range(0, len(xtra_cmds) - 1):
-                    xtra_cmds[index] = xtra_cmds[index][0].upper() + xtra_cmds[index][1:]
-                gcode_before = "\n".join(xtra_cmds)
-            else:
-                gcode_before = gcode_before[0].upper() + gcode_before[1:]
-        gcode_after = self.getSettingValueByKey("custom_gcode_after_pause")
-        if gcode_after != "":
-            if "," in gcode_after:
-                xtra_cmds = gcode_after.split(",")
-                for index in range(0, len(xtra_cmds)):
-                    xtra_cmds[index] = xtra_cmds[index][0].upper() + xtra_cmds[index][1:]
-                gcode_after = "\n".join(xtra_cmds)
-            else:
-                gcode_after = gcode_after[0].upper() + gcode_after[1:]
+        gcode_before = self._normalize_custom_gcode(self.getSettingValueByKey("custom_gcode_before_pause"))
+        gcode_after = self._normalize_custom_gcode(self.getSettingValueByKey("custom_gcode_after_pause"))
         beep_at_pause = self.getSettingValueByKey("beep_at_pause")
         beep_length = self.getSettingValueByKey("beep_length")
         g4_dwell_time = round(self.getSettingValueByKey("g4_dwell_time") * 60)
@@ -519,18 +611,127 @@ class PauseAtLayer(Script):
             custom_pause_command = self.getSettingValueByKey("custom_pause_command")
         else:
             custom_pause_command = ""
+        return _PauseCfg(
+            extruder_count = extruder_count,
+            hold_steppers_on = hold_steppers_on,
+            disarm_timeout = disarm_timeout,
+            reason_for_pause = reason_for_pause,
+            unload_amount = unload_amount,
+            unload_quick_purge = unload_quick_purge,
+            unload_reload_speed = unload_reload_speed,
+            reload_amount = reload_amount,
+            purge_amount = purge_amount,
+            extra_prime_amount = extra_prime_amount,
+            park_enabled = park_enabled,
+            park_x = park_x,
+            park_y = park_y,
+            move_z = move_z,
+            min_purge_clearance = min_purge_clearance,
+            redo_layer = redo_layer,
+            redo_layer_flow = redo_layer_flow,
+            redo_layer_flow_reset = redo_layer_flow_reset,
+            resume_temperature_cmd = resume_temperature_cmd,
+            standby_temperature = standby_temperature,
+            use_tool_temperature = use_tool_temperature,
+            resume_print_temperature = resume_print_temperature,
+            firmware_retract = firmware_retract,
+            control_temperatures = control_temperatures,
+            initial_layer_height = initial_layer_height,
+            layer_height = layer_height,
+            z_hop_enabled = z_hop_enabled,
+            z_hop_height = z_hop_height,
+            gcode_before = gcode_before,
+            gcode_after = gcode_after,
+            beep_at_pause = beep_at_pause,
+            beep_length = beep_length,
+            g4_dwell_time = g4_dwell_time,
+            pause_method = pause_method,
+            custom_pause_command = custom_pause_command)
+
+    # A layer needs to be gone through line by line if the layers start in it or if it has a layer line at or past the pause layer
+    def _may_hold_pause(self, layer: str, layers_started: bool, pause_threshold: int) -> bool:
+        if not layers_started:
+            return ";LAYER:0" in layer
+        for match in _LAYER_LINE_RE.finditer(layer):
+            try:
+                if int(match.group(1)) >= pause_threshold:
+                    return True
+            except ValueError:
+                continue
+        return False
+
+    # Put together the parts of the pause gcode that only depend on the settings.  This is done once in 'execute' instead of once per pause.
+    def _build_pause_template(self, cfg: _PauseCfg) -> _PauseTemplate:
+        # Only the command for the chosen pause method is built
         pause_command = {
-            "marlin": "M0 " + txt_msg + " Click to resume",
-            "marlin2": "M0",
-            "griffin": self.putValue(M = 0),
-            "bq": self.putValue(M = 25),
-            "reprap": self.putValue(M = 226),
-            "repetier": self.putValue("@pause now change filament and press continue printing"),
-            "alt_octo": self.putValue(M = 125),
-            "raise_3d": self.putValue(M = 2000),
-            "klipper": self.putValue("PAUSE"),
-            "custom": self.putValue(str(custom_pause_command)),
-            "g_4": self.putValue(G = 4, S = g4_dwell_time)}[pause_method]
+            "marlin": lambda: "",
+            "marlin2": lambda: "M0",
+            "griffin": lambda: self.putValue(M = 0),
+            "bq": lambda: self.putValue(M = 25),
+            "reprap": lambda: self.putValue(M = 226),
+            "repetier": lambda: self.putValue("@pause now change filament and press continue printing"),
+            "alt_octo": lambda: self.putValue(M = 125),
+            "raise_3d": lambda: self.putValue(M = 2000),
+            "klipper": lambda: self.putValue("PAUSE"),
+            "custom": lambda: self.putValue(str(cfg.custom_pause_command)),
+            "g_4": lambda: self.putValue(G = 4, S = cfg.g4_dwell_time)}[cfg.pause_method]()
+
+        # Break up the unload distance into chunks of 150mm to avoid any firmware balks for 'too long of an extrusion'
+        unload_gcode = ""
+        if cfg.unload_amount > 150:
+            chunks, temp_unload = self._split_150(cfg.unload_amount)
+            unload_gcode = (self.putValue(G = 1, F = int(cfg.unload_reload_speed), E = -150) + "; Unload some\n") * chunks
+            unload_gcode += self.putValue(G = 1, F = int(cfg.unload_reload_speed), E = -temp_unload) + "; Unload the remainder\n"
+        else:
+            unload_gcode = self.putValue(G = 1, E = -cfg.unload_amount, F = int(cfg.unload_reload_speed)) + "; Unload\n"
+
+        # Set the disarm timeout
+        hold_steppers_gcode = ""
+        if cfg.pause_method != "griffin" and cfg.hold_steppers_on:
+            hold_steppers_gcode = self.putValue(M = 84, S = cfg.disarm_timeout)
+            if int(cfg.disarm_timeout) > 0:
+                hold_steppers_gcode += " ; Keep motors engaged for " + str(cfg.disarm_timeout/60) + " minutes\n"
+            else:
+                hold_steppers_gcode += " ; Keep motors engaged until printer power turned off (Marlin).\n"
+
+        # Beep at pause
+        beep_gcode = ""
+        if cfg.beep_at_pause:
+            beep_gcode = self.putValue(M = 300, S = 440, P = cfg.beep_length) + "; Beep\n"
+
+        extrusion_mode_string = "absolute"
+        extrusion_mode_numeric = 82
+        relative_extrusion = Application.getInstance().getGlobalContainerStack().getProperty("relative_extrusion", "value")
+        if relative_extrusion:
+            extrusion_mode_string = "relative"
+            extrusion_mode_numeric = 83
+        return _PauseTemplate(pause_command, unload_gcode, hold_steppers_gcode, beep_gcode, relative_extrusion, extrusion_mode_string, extrusion_mode_numeric)
+
+    def _find_pause(self, new_data: [str], pause_layer: int, txt_msg: str, cfg: _PauseCfg, template: _PauseTemplate) -> [str]:
+        purge_speed = round(self.nozzle_size * 500) # calculate the purge speed based on the nozzle size.  A 0.4 will be 200 and a 0.8 will be 400 mm/min.
+        # The converted speeds and amounts are worked out once here instead of in each line that uses them
+        slow_reload_speed = round(float(self.nozzle_size) * 16.666 * 60)
+        purge_feed_rate = round(float(self.nozzle_size) * 8.333 * 60)
+        retract_speed = int(self.retraction_retract_speed)
+        prime_speed = int(self.retraction_prime_speed)
+        unload_reload_speed = round(int(cfg.unload_reload_speed))
+        unload_amount_i = int(cfg.unload_amount)
+        reload_amount_i = int(cfg.reload_amount)
+        purge_amount_i = int(cfg.purge_amount)
+        # These two can change while looking for the pause so they are copied from the settings
+        move_z = cfg.move_z
+        resume_print_temperature = cfg.resume_print_temperature
+        layers_started = False
+        display_text = txt_msg
+        # The extrusion mode was looked up once for all the pauses when the template was built
+        relative_extrusion = template.relative_extrusion
+        extrusion_mode_string = template.extrusion_mode_string
+        extrusion_mode_numeric = template.extrusion_mode_numeric
+        # The Marlin pause command is the only one that includes the message
+        if cfg.pause_method == "marlin":
+            pause_command = "M0 " + txt_msg + " Click to resume"
+        else:
+            pause_command = template.pause_command
 
         # use offset to calculate the current height: <current_height> = <current_z> - <layer_0_z>
         layer_0_z = 0
@@ -545,31 +746,51 @@ class PauseAtLayer(Script):
         nbr_negative_layers = 0
 
         for index, layer in enumerate(new_data):
+            # Layers that can't hold the pause are skipped with whole-layer string and regex scans.  Only the layer counts, the last Z
+            # and the last print temperature need to be carried through them.
+            if not self._may_hold_pause(layer, layers_started, pause_layer - nbr_negative_layers - layer.count(";LAYER:-")):
+                nbr_negative_layers += layer.count(";LAYER:-")
+                if cfg.use_tool_temperature:
+                    temp_match = None
+                    for temp_match in _TEMP_LINE_RE.finditer(layer):
+                        pass
+                    if temp_match is not None:
+                        resume_print_temperature = _parse_params(temp_match.group(0)).get("S")
+                if layers_started:
+                    z_match = None
+                    for z_match in _Z_LINE_RE.finditer(layer):
+                        pass
+                    if z_match is not None:
+                        current_z = _parse_params(z_match.group(0))["Z"]
+                continue
             lines = layer.split("\n")
 
             # Scroll each line of instruction for each layer in the G-code
             for line in lines:
-                # First positive layer reached
-                if ";LAYER:0" in line:
-                    layers_started = True
-                # Count nbr of negative layers (raft)
-                elif ";LAYER:-" in line:
-                    nbr_negative_layers += 1
-                # Track the latest printing temperature in order to resume at the correct temperature.
-                if use_tool_temperature:
-                    if line.startswith("M109 S") or line.startswith("M104 S"):
-                        resume_print_temperature = self.getValue(line, "S")
-                if not layers_started:
-                    continue
-                # Look for the feed rate of an extrusion instruction
-                if self.getValue(line, "F") is not None and self.getValue(line, "E") is not None:
-                    current_extrusion_f = self.getValue(line, "F")
-                # If a Z instruction is in the line, read the current Z
-                if self.getValue(line, "Z") is not None:
-                    current_z = self.getValue(line, "Z")
-
-                if not line.startswith(";LAYER:"):
+                # Comment lines don't have any parameters and gcode lines aren't layer markers so each only gets its own checks
+                if line[:1] == ";":
+                    # First positive layer reached
+                    if ";LAYER:0" in line:
+                        layers_started = True
+                    # Count nbr of negative layers (raft)
+                    elif ";LAYER:-" in line:
+                        nbr_negative_layers += 1
+                    if not layers_started or not line.startswith(";LAYER:"):
+                        continue
+                else:
+                    # Track the latest printing temperature in order to resume at the correct temperature.
+                    if cfg.use_tool_temperature and line.startswith(_TEMP_PREFIXES):
+                        resume_print_temperature = _parse_params(line).get("S")
+                    if layers_started:
+                        params = _parse_params(line)
+                        # Look for the feed rate of an extrusion instruction
+                        if "F" in params and "E" in params:
+                            current_extrusion_f = params["F"]
+                        # If a Z instruction is in the line, read the current Z
+                        if "Z" in params:
+                            current_z = params["Z"]
                     continue
+
                 current_layer = line[len(";LAYER:"):]
                 try:
                     current_layer = int(current_layer)
@@ -582,43 +803,46 @@ class PauseAtLayer(Script):
 
                 # Access last layer, browse it backwards to find last extruder absolute position check if it is a retraction
                 prev_layer = new_data[index - 1]
-                prev_lines = prev_layer.split("\n")
                 is_retracted = None
                 current_e = None
-                for prevLine in reversed(prev_lines):
-                    current_e = self.getValue(prevLine, "E")
-                    if re.search("G1 F(\d+\.\d+|\d+) E(-?\d+\.\d+|-?\d+)", prevLine) or "G10" in prevLine:
-                        if is_retracted == None:
-                            is_retracted = True
-                    if current_e is not None:
-                        if is_retracted is None:
-                            is_retracted = False
+                # and also find last X,Y.  Both are found in one backwards pass that stops when it has them both.
+                found_e = False
+                found_xy = False
+                for prevLine in self._reversed_lines(prev_layer):
+                    params = _parse_params(prevLine)
+                    if not found_e:
+                        current_e = params.get("E")
+                        if _RETRACT_ANY_RE.search(prevLine):
+                            if is_retracted == None:
+                                is_retracted = True
+                        if current_e is not None:
+                            if is_retracted is None:
+                                is_retracted = False
+                            found_e = True
+                    if not found_xy and prevLine[:2] in _MOVE_CMDS and "X" in params and "Y" in params:
+                        x = params["X"]
+                        y = params["Y"]
+                        found_xy = True
+                    if found_e and found_xy:
                         break
 
-                # and also find last X,Y
-                for prevLine in reversed(prev_lines):
-                    if prevLine.startswith(("G0", "G1", "G2", "G3")):
-                        if self.getValue(prevLine, "X") is not None and self.getValue(prevLine, "Y") is not None:
-                            x = self.getValue(prevLine, "X")
-                            y = self.getValue(prevLine, "Y")
-                            break
-
                 # Maybe redo the previous layer.
-                if redo_layer and reason_for_pause == "reason_filament":
+                if cfg.redo_layer and cfg.reason_for_pause == "reason_filament":
                     prev_layer = new_data[index - 1]
-                    temp_list = prev_layer.split("\n")
-                    temp_list[0] = temp_list[0] + str(" " * (27 - len(temp_list[0] + ".1"))) + "; Redo layer from PauseAtLayer\n" + redo_layer_flow
-                    prev_layer = "\n".join(temp_list)
-                    layer = prev_layer + redo_layer_flow_reset + layer
+                    # Only the first line changes so the layer isn't split into lines
+                    first_line, sep, rest = prev_layer.partition("\n")
+                    prev_layer = f"{first_line:<25}; Redo layer from PauseAtLayer\n" + cfg.redo_layer_flow + sep + rest
+                    layer = prev_layer + cfg.redo_layer_flow_reset + layer
                     new_data[index] = layer
                     new_data = self._renumber_layers(new_data, "renum")
                     # Get the X Y position and the extruder's absolute position at the beginning of the redone layer.
                     x, y = self.getNextXY(layer)
-                    prev_lines = prev_layer.split("\n")
-                    for lin in prev_lines:
-                        new_e = self.getValue(lin, "E", current_e)
+                    # Jump from one E line to the next with a regex instead of going through every line.  The layer line has no E so only the rest of the previous layer is searched
+                    for e_match in _E_LINE_RE.finditer(rest):
+                        lin = e_match.group(0)
+                        new_e = _parse_params(lin).get("E", current_e)
                         if new_e != current_e:
-                            if re.search("G1 F(\d+\.\d+|\d+) E(-?\d+\.\d+|-?\d+)", lin) or "G10" in lin:
+                            if _RETRACT_ANY_RE.search(lin):
                                 if is_retracted == None:
                                     is_retracted = True
                                 if current_e is not None:
@@ -627,139 +851,114 @@ class PauseAtLayer(Script):
                             current_e = new_e
                             break
 
-                # Start putting together the pause string 'prepend_gcode'
-                prepend_gcode = f";TYPE:CUSTOM---------------; Pause at end of preview layer {current_layer} (end of Gcode LAYER:{int(current_layer) - 1})\n"
-                if pause_method == "repetier":
+                # Start putting together the pause string 'prepend_gcode'.  The pieces are collected in a list and joined once.
+                prepend_parts = [f";TYPE:CUSTOM---------------; Pause at end of preview layer {current_layer} (end of Gcode LAYER:{int(current_layer) - 1})\n"]
+                if cfg.pause_method == "repetier":
                     # Retraction
-                    prepend_gcode += self.putValue(M = 83) + "; Relative extrusion\n"
+                    prepend_parts.append("M83; Relative extrusion\n")
                     if not is_retracted and self.retraction_enabled:
-                        prepend_gcode += self.putValue(G = 1, F = self.retraction_retract_speed, E = -self.retraction_amount) + "; Retract\n"
-                    if park_enabled:
+                        prepend_parts.append(self.putValue(G = 1, F = self.retraction_retract_speed, E = -self.retraction_amount) + "; Retract\n")
+                    if cfg.park_enabled:
                         # Move the head to the park location
                         if current_z + move_z > self._machine_height:
                             move_z = 0
-                        prepend_gcode += self.putValue(G = 0, F = self.speed_z_hop, Z = round(current_z + move_z, 2)) + "; Move up to clear the print\n"
-                        prepend_gcode += self.putValue(G = 0, X = park_x, Y = park_y, F = self.speed_travel) + "; Move to park location\n"
+                        prepend_parts.append(self.putValue(G = 0, F = self.speed_z_hop, Z = round(current_z + move_z, 2)) + "; Move up to clear the print\n")
+                        prepend_parts.append(self.putValue(G = 0, X = cfg.park_x, Y = cfg.park_y, F = self.speed_travel) + "; Move to park location\n")
                         if current_z < move_z:
-                            prepend_gcode += self.putValue(G = 0, F = self.speed_z_hop, Z = current_z + move_z) + "; Move up to clear the print\n"
+                            prepend_parts.append(self.putValue(G = 0, F = self.speed_z_hop, Z = current_z + move_z) + "; Move up to clear the print\n")
                     # Disable the E steppers
-                    prepend_gcode += self.putValue(M = 84, E = 0) + "; Disable Steppers\n"
+                    prepend_parts.append("M84 E0; Disable Steppers\n")
 
-                elif pause_method != "griffin":
+                elif cfg.pause_method != "griffin":
                     # Retraction
-                    prepend_gcode += self.putValue(M = 83) + "; Relative extrusion\n"
+                    prepend_parts.append("M83; Relative extrusion\n")
                     if not is_retracted and self.retraction_enabled:
-                        if firmware_retract:
-                            prepend_gcode += "G10\n"
+                        if cfg.firmware_retract:
+                            prepend_parts.append("G10\n")
                         else:
-                            prepend_gcode += self.putValue(G = 1, F = self.retraction_retract_speed, E = -self.retraction_amount) + "; Retract\n"
-                    if park_enabled:
+                            prepend_parts.append(self.putValue(G = 1, F = self.retraction_retract_speed, E = -self.retraction_amount) + "; Retract\n")
+                    if cfg.park_enabled:
                         # Move the head to the park position
                         if current_z + move_z > self._machine_height:
                             move_z = 0
-                        prepend_gcode += self.putValue(G = 0, F = self.speed_z_hop, Z = round(current_z + move_z, 2)) + "; Move up to clear the print\n"
-                        prepend_gcode += self.putValue(G = 0, F = self.speed_travel, X = park_x, Y = park_y) + "; Move to park location\n"
-                        if current_z < min_purge_clearance - move_z:
-                            prepend_gcode += self.putValue(G = 0, F = self.speed_z_hop, Z = min_purge_clearance) + "; Minimum clearance" + str(" to purge" if purge_amount != 0 and reason_for_pause == 'reason_filament' else "") + " - move up some more\n"
+                        prepend_parts.append(self.putValue(G = 0, F = self.speed_z_hop, Z = round(current_z + move_z, 2)) + "; Move up to clear the print\n")
+                        prepend_parts.append(self.putValue(G = 0, F = self.speed_travel, X = cfg.park_x, Y = cfg.park_y) + "; Move to park location\n")
+                        if current_z < cfg.min_purge_clearance - move_z:
+                            prepend_parts.append(self.putValue(G = 0, F = self.speed_z_hop, Z = cfg.min_purge_clearance) + "; Minimum clearance" + str(" to purge" if cfg.purge_amount != 0 and cfg.reason_for_pause == 'reason_filament' else "") + " - move up some more\n")
 
                     # 'Unload' and 'purge' are only available if there is a filament change.
-                    if reason_for_pause == "reason_filament" and int(unload_amount) > 0:
+                    if cfg.reason_for_pause == "reason_filament" and unload_amount_i > 0:
                         # If it's a filament change then insert any 'unload' commands
-                        prepend_gcode += self.putValue(M = 400) + "; Complete all moves\n"
+                        prepend_parts.append("M400; Complete all moves\n")
                         # Break up the unload distance into chunks of 150mm to avoid any firmware balks for 'too long of an extrusion'
-                        if unload_amount > 0:
+                        if cfg.unload_amount > 0:
                             # The quick purge is meant to soften the filament end to insure it will retract.
-                            if unload_quick_purge:
+                            if cfg.unload_quick_purge:
                                 quick_purge_amt = self.retraction_amount + 7 if self.retraction_amount < 2 else self.retraction_amount * 2.5
-                                prepend_gcode += f"G1 F{purge_speed} E{quick_purge_amt} ; Quick purge before unload\n"
-                        if unload_amount > 150:
-                            temp_unload = unload_amount
-                            while temp_unload > 150:
-                                prepend_gcode += self.putValue(G = 1, F = int(unload_reload_speed), E = -150) + "; Unload some\n"
-                                temp_unload -= 150
-                            if 0 < temp_unload <= 150:
-                                prepend_gcode += self.putValue(G = 1, F = int(unload_reload_speed), E = -temp_unload) + "; Unload the remainder\n"
-                        else:
-                            prepend_gcode += self.putValue(G = 1, E = -unload_amount, F = int(unload_reload_speed)) + "; Unload\n"
+                                prepend_parts.append(f"G1 F{purge_speed} E{quick_purge_amt} ; Quick purge before unload\n")
+                        prepend_parts.append(template.unload_gcode)
 
                     # Set extruder standby temperature
-                    if control_temperatures:
-                        prepend_gcode += self.putValue(M = 104, S = round(standby_temperature)) + "; Standby temperature\n"
+                    if cfg.control_temperatures:
+                        prepend_parts.append(self.putValue(M = 104, S = round(cfg.standby_temperature)) + "; Standby temperature\n")
 
                 if display_text:
-                    prepend_gcode += "M117 " + txt_msg + "; Message to LCD\n"
-
-                # Set the disarm timeout
-                if pause_method != "griffin":
-                    if hold_steppers_on:
-                        prepend_gcode += self.putValue(M = 84, S = disarm_timeout)
-                        if int(disarm_timeout) > 0:
-                            prepend_gcode += " ; Keep motors engaged for " + str(disarm_timeout/60) + " minutes\n"
-                        else:
-                            prepend_gcode += " ; Keep motors engaged until printer power turned off (Marlin).\n"
+                    prepend_parts.append("M117 " + txt_msg + "; Message to LCD\n")
 
-                # Beep at pause
-                if beep_at_pause:
-                    prepend_gcode += self.putValue(M = 300, S = 440, P = beep_length) + "; Beep\n"
+                # Set the disarm timeout and beep at pause
+                prepend_parts.append(template.hold_steppers_gcode)
+                prepend_parts.append(template.beep_gcode)
 
                 # Set a custom GCODE section before pause
-                if gcode_before:
-                    prepend_gcode += gcode_before + "\n"
+                if cfg.gcode_before:
+                    prepend_parts.append(cfg.gcode_before + "\n")
 
                 if txt_msg:
-                    prepend_gcode += "M118 " + str(txt_msg) + " ; Message to print server\n"
+                    prepend_parts.append("M118 " + str(txt_msg) + " ; Message to print server\n")
 
                 # Wait till the user continues printing
-                prepend_gcode += pause_command + "; Do the actual pause\n"
+                prepend_parts.append(pause_command + "; Do the actual pause\n")
 
                 # Set a custom GCODE section after pause
-                if gcode_after:
-                    prepend_gcode += gcode_after + "\n"
+                if cfg.gcode_after:
+                    prepend_parts.append(cfg.gcode_after + "\n")
                 
                 # If redoing a layer then move back own to the previous layer height.
-                if redo_layer:
-                    working_z = current_z - (self.layer_height if not self.z_hop_enabled else 0)
+                if cfg.redo_layer:
+                    working_z = current_z - (cfg.layer_height if not cfg.z_hop_enabled else 0)
                     working_z_txt = "; Move down to redo layer height\n"
                 else:
                     working_z = current_z
                     working_z_txt = "; Move down to resume height\n"                    
-                if pause_method == "repetier":
+                if cfg.pause_method == "repetier":
                     # Optionally extrude material
-                    if int(purge_amount) != 0:
-                        prepend_gcode += self.putValue(G = 1, F = purge_speed, E = purge_amount) + "; Extra extrude after the unpause\n"
-                        prepend_gcode += self.putValue("     @info wait for cleaning nozzle from previous filament") + "\n"
-                        prepend_gcode += self.putValue("     @pause remove the waste filament from parking area and press continue printing") + "\n"
+                    if purge_amount_i != 0:
+                        prepend_parts.append(self.putValue(G = 1, F = purge_speed, E = cfg.purge_amount) + "; Extra extrude after the unpause\n")
+                        prepend_parts.append(self.putValue("     @info wait for cleaning nozzle from previous filament") + "\n")
+                        prepend_parts.append(self.putValue("     @pause remove the waste filament from parking area and press continue printing") + "\n")
 
                     # Retract before moving back to the print.
-                    if purge_amount != 0 and self.retraction_enabled:
-                        prepend_gcode += self.putValue(G = 1, E = -self.retraction_amount, F = self.retraction_retract_speed) + ";Retract\n"
+                    if cfg.purge_amount != 0 and self.retraction_enabled:
+                        prepend_parts.append(self.putValue(G = 1, E = -self.retraction_amount, F = self.retraction_retract_speed) + ";Retract\n")
 
                     # Move the head back to the resume position
                            
-                    if park_enabled:
-                        prepend_gcode += self.putValue(G = 0, F = self.speed_travel, X = x, Y = y) + ";Return to print location\n"
-                        prepend_gcode += self.putValue(G = 0, F = self.speed_z_hop, Z = working_z) + working_z_txt
-
-                    if purge_amount != 0 and self.retraction_enabled:
-                        prepend_gcode += self.putValue(G = 1, E = self.retraction_amount, F = self.retraction_prime_speed) + ";Unretract\n"
+                    if cfg.park_enabled:
+                        prepend_parts.append(self.putValue(G = 0, F = self.speed_travel, X = x, Y = y) + ";Return to print location\n")
+                        prepend_parts.append(self.putValue(G = 0, F = self.speed_z_hop, Z = working_z) + working_z_txt)
 
-                    extrusion_mode_string = "absolute"
-                    extrusion_mode_numeric = 82
+                    if cfg.purge_amount != 0 and self.retraction_enabled:
+                        prepend_parts.append(self.putValue(G = 1, E = self.retraction_amount, F = self.retraction_prime_speed) + ";Unretract\n")
 
-                    relative_extrusion = Application.getInstance().getGlobalContainerStack().getProperty("relative_extrusion", "value")
-                    if relative_extrusion:
-                        extrusion_mode_string = "relative"
-                        extrusion_mode_numeric = 83
-
-                    prepend_gcode += self.putValue(M = extrusion_mode_numeric) + "; switch back to " + extrusion_mode_string + " E values\n"
+                    prepend_parts.append(self.putValue(M = extrusion_mode_numeric) + "; switch back to " + extrusion_mode_string + " E values\n")
 
                     # Reset extruder value to pre pause value
-                    prepend_gcode += self.putValue(G = 92, E = current_e) + ";Reset extruder\n"
+                    prepend_parts.append(self.putValue(G = 92, E = current_e) + ";Reset extruder\n")
 
-                elif pause_method != "griffin":
-                    if control_temperatures:
+                elif cfg.pause_method != "griffin":
+                    if cfg.control_temperatures:
                         # Set extruder resume temperature
-                        if resume_temperature_cmd == "m109_cmd" or use_tool_temperature:
+                        if cfg.resume_temperature_cmd == "m109_cmd" or cfg.use_tool_temperature:
                             WFT_numeric = 109
                             WFT_param = "R"
                             Temp_resume_Text = "; Wait for resume temperature\n"
@@ -768,89 +967,79 @@ class PauseAtLayer(Script):
                             WFT_param = "S"
                             Temp_resume_Text = "; Resume temperature\n"
 
-                        prepend_gcode += f"M{WFT_numeric} {WFT_param}{int(resume_print_temperature)} {Temp_resume_Text}"
+                        prepend_parts.append(f"M{WFT_numeric} {WFT_param}{int(resume_print_temperature)} {Temp_resume_Text}")
 
                     # Load and Purge.  Break the load amount in 150mm chunks to avoid 'too long of extrusion' warnings from firmware.
-                    if reason_for_pause == "reason_filament":
-                        if int(reload_amount) > 0:
-                            if reload_amount * .9 > 150:
-                                temp_reload = reload_amount - reload_amount * .1
-                                while temp_reload > 150:
-                                    prepend_gcode += self.putValue(G = 1, E = 150, F = unload_reload_speed) + "; Fast Reload\n"
-                                    temp_reload -= 150
-                                if 0 < temp_reload <= 150:
-                                    prepend_gcode += self.putValue(G = 1, E = round(temp_reload), F = round(int(unload_reload_speed))) + "; Fast Reload\n"
-                                    prepend_gcode += self.putValue(G = 1, E = round(reload_amount * .1), F = round(float(self.nozzle_size) * 16.666 * 60)) + "; Reload the remaining 10% slow to avoid ramming the nozzle\n"
-                                else:
-                                    prepend_gcode += self.putValue(G = 1, E = round(reload_amount * .1), F = round(float(self.nozzle_size) * 16.666 * 60)) + "; Reload the remaining 10% slow to avoid ramming the nozzle\n"
+                    if cfg.reason_for_pause == "reason_filament":
+                        if reload_amount_i > 0:
+                            if cfg.reload_amount * .9 > 150:
+                                chunks, temp_reload = self._split_150(cfg.reload_amount - cfg.reload_amount * .1)
+                                prepend_parts.append((self.putValue(G = 1, E = 150, F = cfg.unload_reload_speed) + "; Fast Reload\n") * chunks)
+                                prepend_parts.append(self.putValue(G = 1, E = round(temp_reload), F = unload_reload_speed) + "; Fast Reload\n")
+                                prepend_parts.append(self.putValue(G = 1, E = round(cfg.reload_amount * .1), F = slow_reload_speed) + "; Reload the remaining 10% slow to avoid ramming the nozzle\n")
                             else:
-                                prepend_gcode += self.putValue(G = 1, E = round(reload_amount * .9), F = round(int(unload_reload_speed))) + "; Fast Reload\n"
-                                prepend_gcode += self.putValue(G = 1, E = round(reload_amount * .1), F = round(float(self.nozzle_size) * 16.666 * 60)) + "; Reload the last 10% slower to avoid ramming the nozzle\n"
-                        if int(purge_amount) > 0:
-                            prepend_gcode += self.putValue(G = 1, E = purge_amount, F = round(float(self.nozzle_size) * 8.333 * 60)) + "; Purge\n"
-                            if not firmware_retract and self.retraction_enabled:
-                                prepend_gcode += self.putValue(G = 1, E = -self.retraction_amount, F = int(self.retraction_retract_speed)) + "; Retract\n"
-                            elif firmware_retract and self.retraction_enabled:
-                                prepend_gcode += self.putValue(G = 10) + "; Retract\n"
+                                prepend_parts.append(self.putValue(G = 1, E = round(cfg.reload_amount * .9), F = unload_reload_speed) + "; Fast Reload\n")
+                                prepend_parts.append(self.putValue(G = 1, E = round(cfg.reload_amount * .1), F = slow_reload_speed) + "; Reload the last 10% slower to avoid ramming the nozzle\n")
+                        if purge_amount_i > 0:
+                            prepend_parts.append(self.putValue(G = 1, E = cfg.purge_amount, F = purge_feed_rate) + "; Purge\n")
+                            if not cfg.firmware_retract and self.retraction_enabled:
+                                prepend_parts.append(self.putValue(G = 1, E = -self.retraction_amount, F = retract_speed) + "; Retract\n")
+                            elif cfg.firmware_retract and self.retraction_enabled:
+                                prepend_parts.append("G10; Retract\n")
                             # If there is a purge then give the user time to grab the string before the head moves back to the print position.
-                            prepend_gcode += self.putValue(M = 400) + "; Complete all moves\n"
-                            prepend_gcode += self.putValue(M = 300, P=250) + "; Beep\n"
-                            prepend_gcode += self.putValue(G = 4, S = 2) + "; Wait for 2 seconds\n"
+                            prepend_parts.append("M400; Complete all moves\n")
+                            prepend_parts.append("M300 P250; Beep\n")
+                            prepend_parts.append("G4 S2; Wait for 2 seconds\n")
 
                     # Move the head back
-                    if park_enabled:
-                        prepend_gcode += self.putValue(G = 0, F = self.speed_travel, X = x, Y = y) + "; Move to resume location\n"
-                        prepend_gcode += self.putValue(G = 0, F = self.speed_z_hop, Z = working_z) + working_z_txt
+                    if cfg.park_enabled:
+                        prepend_parts.append(self.putValue(G = 0, F = self.speed_travel, X = x, Y = y) + "; Move to resume location\n")
+                        prepend_parts.append(self.putValue(G = 0, F = self.speed_z_hop, Z = working_z) + working_z_txt)
 
-                    if purge_amount != 0:
-                        if firmware_retract and not is_retracted and self.retraction_enabled:
-                            retraction_count = 1 if control_temperatures else 3 # Retract more if we don't control the temperature.
+                    if cfg.purge_amount != 0:
+                        if cfg.firmware_retract and not is_retracted and self.retraction_enabled:
+                            retraction_count = 1 if cfg.control_temperatures else 3 # Retract more if we don't control the temperature.
                             for i in range(retraction_count):
-                                prepend_gcode += self.putValue(G = 11) + ";Unretract\n"
+                                prepend_parts.append("G11;Unretract\n")
                         else:
                             if not is_retracted and self.retraction_enabled:
-                                prepend_gcode += self.putValue(G = 1, F = self.retraction_prime_speed, E = self.retraction_amount) + "; Unretract\n"
+                                prepend_parts.append(self.putValue(G = 1, F = self.retraction_prime_speed, E = self.retraction_amount) + "; Unretract\n")
 
                     # If the pause is for something like an insertion then there might be an extra prime amount
-                    if extra_prime_amount != "0" and reason_for_pause == "reason_other":
-                        prepend_gcode += self.putValue(G = 1, E = extra_prime_amount, F = int(self.retraction_prime_speed)) + "; Extra Prime\n"
-
-                    extrusion_mode_string = "absolute"
-                    extrusion_mode_numeric = 82
+                    if cfg.extra_prime_amount != "0" and cfg.reason_for_pause == "reason_other":
+                        prepend_parts.append(self.putValue(G = 1, E = cfg.extra_prime_amount, F = prime_speed) + "; Extra Prime\n")
 
-                    relative_extrusion = Application.getInstance().getGlobalContainerStack().getProperty("relative_extrusion", "value")
-                    if relative_extrusion:
-                        extrusion_mode_string = "relative"
-                        extrusion_mode_numeric = 83
-
-                    if not redo_layer:
-                        prepend_gcode += self.putValue(M = extrusion_mode_numeric) + "; Switch back to " + extrusion_mode_string + " E values\n"
+                    if not cfg.redo_layer:
+                        prepend_parts.append(self.putValue(M = extrusion_mode_numeric) + "; Switch back to " + extrusion_mode_string + " E values\n")
 
                     # Reset extruder value to pre pause value
-                        prepend_gcode += self.putValue(G = 92, E = 0 if relative_extrusion else current_e) + "; Reset extruder location\n"
+                        prepend_parts.append(self.putValue(G = 92, E = 0 if relative_extrusion else current_e) + "; Reset extruder location\n")
 
-                    if redo_layer and reason_for_pause == "reason_filament":
+                    if cfg.redo_layer and cfg.reason_for_pause == "reason_filament":
                         # All other options reset the E value to what it was before the pause because E things were added.
                         # If it's not yet reset, it still needs to be reset if there were any redo layers.
                         if is_retracted:
-                            prepend_gcode += self.putValue(G = 92, E = 0 if relative_extrusion else current_e - self.retraction_amount) + "; Reset extruder location ~ retracted\n"
-                            prepend_gcode += self.putValue(M = extrusion_mode_numeric) + "; Switch back to " + extrusion_mode_string + " E values\n"
+                            prepend_parts.append(self.putValue(G = 92, E = 0 if relative_extrusion else current_e - self.retraction_amount) + "; Reset extruder location ~ retracted\n")
+                            prepend_parts.append(self.putValue(M = extrusion_mode_numeric) + "; Switch back to " + extrusion_mode_string + " E values\n")
                         else:
-                            prepend_gcode += self.putValue(G = 92, E = 0 if relative_extrusion else current_e) + "; Reset extruder location ~ unretracted\n"
-                            prepend_gcode += self.putValue(M = extrusion_mode_numeric) + "; Switch back to " + extrusion_mode_string + " E values\n"
-                    elif redo_layer and reason_for_pause == "reason_other":
-                        prepend_gcode += self.putValue(M = extrusion_mode_numeric) + "; Switch back to " + extrusion_mode_string + " E values\n"
+                            prepend_parts.append(self.putValue(G = 92, E = 0 if relative_extrusion else current_e) + "; Reset extruder location ~ unretracted\n")
+                            prepend_parts.append(self.putValue(M = extrusion_mode_numeric) + "; Switch back to " + extrusion_mode_string + " E values\n")
+                    elif cfg.redo_layer and cfg.reason_for_pause == "reason_other":
+                        prepend_parts.append(self.putValue(M = extrusion_mode_numeric) + "; Switch back to " + extrusion_mode_string + " E values\n")
                 # Format prepend_gcode
-                prepend_gcode += f";{'-' * 26}; End of the Pause code"
-                temp_lines = prepend_gcode.split("\n")
+                prepend_parts.append(f";{'-' * 26}; End of the Pause code")
+                temp_lines = "".join(prepend_parts).split("\n")
                 for temp_index, temp_line in enumerate(temp_lines):
-                    if ";" in temp_line and not temp_line.startswith(";"):
-                        temp_lines[temp_index] = temp_line.replace(temp_line.split(";")[0], temp_line.split(";")[0] + str(" " * (27 - len(temp_line.split(";")[0]))),1)
+                    # Only lines with a command and a comment are aligned
+                    cmd_part, sep, comment_part = temp_line.partition(";")
+                    if sep and cmd_part:
+                        temp_lines[temp_index] = cmd_part.ljust(27) + sep + comment_part
                 prepend_gcode = "\n".join(temp_lines)
                 # Insert the Pause Prepend snippet at the end of the previous layer just before "TIME_ELAPSED".
-                layer_lines = new_data[index - 1].split("\n")
-                layer_lines.insert(len(layer_lines) - 2, prepend_gcode)
-                new_data[index -1 ] = "\n".join(layer_lines)
+                # The snippet goes in front of the second to last line so find that line's start rather than splitting the layer.
+                prev_layer = new_data[index - 1]
+                insert_at = prev_layer.rfind("\n", 0, prev_layer.rfind("\n")) + 1
+                new_data[index - 1] = prev_layer[:insert_at] + prepend_gcode + "\n" + prev_layer[insert_at:]
                 return new_data
         return new_data
 
@@ -866,69 +1055,77 @@ class PauseAtLayer(Script):
                 layer0_index = num
                 break
 
-        # Concantenate the one_data list items that were added to the beginning of each separate model
-        for num in range(layer0_index,len(one_data) - 2,1):
-            if num + 1 == len(one_data) - 2: break # Avoid concantenating the Ending Gcode
-            try:
-                while not ";LAYER:" in one_data[num + 1]:
-                    one_data[num] += str(one_data[num + 1]) + "\n"
-                    one_data.pop(num + 1)
-            except:
-                continue
+        # Concantenate the one_data list items that were added to the beginning of each separate model.  The merged list is built
+        # in one pass (rather than popping items out of the middle of the list) and then put back into the same list object.
+        last = len(one_data)
+        merged_data = one_data[:layer0_index]
+        num = layer0_index
+        head = layer0_index
+        while num < last - 2 and head < last:
+            if head + 1 == last - 2: break # Avoid concantenating the Ending Gcode
+            parts = [one_data[head]]
+            nxt = head + 1
+            while nxt < last and not ";LAYER:" in one_data[nxt]:
+                parts.append(str(one_data[nxt]) + "\n")
+                nxt += 1
+            merged_data.append("".join(parts))
+            head = nxt
+            num += 1
+        merged_data.extend(one_data[head:])
+        one_data[:] = merged_data
+        # Which sections have a layer line.  The later passes change the numbers and move lines around but don't add or remove layer lines.
+        has_layer = [";LAYER:" in layer for layer in one_data]
 
-        # Renumber the layers
+        # Renumber the layers.  The map of new number to original number is kept so 'un_renum' can put the original numbers back.
         if renum_layers == "renum":
+            old_map = self._renum_map
+            self._renum_map = {}
             lay_num = 0
             for num in range(layer0_index,len(one_data),1):
                 layer = one_data[num]
-                if ";LAYER:" in layer and not ";LAYER:-" in layer:
-                    #temp = layer.split("\n")
-                    one_data[num] = re.sub(";LAYER:(\d.+)", ";LAYER:" + str(lay_num), layer)
+                if has_layer[num] and not ";LAYER:-" in layer:
+                    # The layer lines are renumbered and their old numbers collected in the same pass over the section
+                    layer_nrs = []
+                    new_layer_line = ";LAYER:" + str(lay_num)
+                    one_data[num] = _LAYER_RENUM_RE.sub(lambda m: layer_nrs.append(m.group(1)) or new_layer_line, layer)
+                    if layer_nrs:
+                        # A redo layer puts the previous layer in front so the section's own number is the last one.
+                        # A layer that was already renumbered maps back to its first number.
+                        orig_num = int(layer_nrs[-1])
+                        self._renum_map[lay_num] = old_map.get(orig_num, orig_num)
                     lay_num += 1
-            layer = one_data[layer0_index - 1]
 
         # Revert the numbering to OneAtATime if enabled
         elif renum_layers == "un_renum":
-            lay_num = 0
             for num in range(layer0_index,len(one_data),1):
                 layer = one_data[num]
-                if layer.startswith(";LAYER:") and not layer.startswith(";LAYER:-"):
-                    temp = layer.split("\n")
-                    one_data[num] = layer.replace(temp[0],";LAYER:" + str(lay_num))
-                    lay_num += 1
-                if ";LAYER_COUNT:" in layer:
-                    lay_num = 0
-            layer = one_data[layer0_index - 1]
+                if layer.startswith(";LAYER:") and layer[7:8] != "-":
+                    one_data[num] = _LAYER_RENUM_RE.sub(lambda m: ";LAYER:" + str(self._renum_map.get(int(m.group(1)), m.group(1))), layer)
 
         # Move the 'Time_elapsed' and 'Layer_Count' lines to the end of their one_data sections in case of a following PauseAtHeight
-        modified_data = ""
+        # The lines are lifted out with a regex and the blank lines left behind are squeezed out rather than splitting each section.
         for num in range(2,len(one_data)-2,1):
             layer = one_data[num]
-            lines = layer.split("\n")
-            modified_data = ""
-            time_line = ""
-            for line in lines:
-                if line.startswith(";TIME_ELAPSED:") or line.startswith(";LAYER_COUNT:"):
-                    time_line += line + "\n"
-                    line = ""
-                if line != "":
-                    modified_data += line + "\n"
-            one_data[num] = modified_data + time_line
+            time_lines = _TIME_LINE_RE.findall(layer)
+            rest = _BLANK_LINES_RE.sub("\n", _TIME_LINE_RE.sub("", layer)).strip("\n")
+            pieces = [rest] if rest else []
+            pieces.extend(time_lines)
+            one_data[num] = "\n".join(pieces) + "\n" if pieces else ""
 
         # If re-numbering then change each LAYER_COUNT line to reflect the new total layers
         if renum_layers == "renum":
             for num in range(1,len(one_data)-1,1):
                 layer = one_data[num]
-                one_data[num] = re.sub(";LAYER_COUNT:(\d*)",";LAYER_COUNT:" + str(len(one_data) - 3),layer)
+                one_data[num] = _LAYER_COUNT_RE.sub(";LAYER_COUNT:" + str(len(one_data) - 3), layer)
 
         # If reverting to one-at-a-time then change the LAYER_COUNT back to per model
         elif renum_layers == "un_renum":
             model_lay_count = 0
             for num in range(len(one_data)-1,1,-1):
-                if ";LAYER:" in one_data[num]:
+                if has_layer[num]:
                     model_lay_count += 1
                 if ";LAYER:0" in one_data[num]:
-                    one_data[num-1] = re.sub(";LAYER_COUNT:(\d*)",";LAYER_COUNT:" + str(model_lay_count), one_data[num-1])
+                    one_data[num-1] = _LAYER_COUNT_RE.sub(";LAYER_COUNT:" + str(model_lay_count), one_data[num-1])
                     model_lay_count = 0
         return one_data
 
@@ -944,15 +1141,22 @@ class PauseAtLayer(Script):
         self.nozzle_size = extruder[tool_nr].getProperty("machine_nozzle_size", "value")
         return
 
-    # For multi-extruder machines - track the tool so the proper settings get used in the pause.
-    def _track_tool_nr(self, data: str, pause_layer: int) -> int:
+    # Map each layer number to the index of its section in the data.  If a layer number is repeated (one-at-a-time) the first one is kept.
+    def _index_layers(self, data: List[str]) -> dict:
+        layer_index = {}
         for index, layer in enumerate(data):
-            if ";LAYER:" + str(pause_layer) + "\n" in layer:
-                pause_index = index
-                break
-        for num in range(1, pause_index):
-            lines = data[num].split("\n")
-            for t_index, tool_line in enumerate(lines):
-                if tool_line.startswith("T"):
-                    tool_nr = self.getValue(tool_line, "T")
-        return tool_nr
\ No newline at end of file
+            match = _LAYER_NR_RE.search(layer)
+            if match is not None:
+                layer_index.setdefault(int(match.group(1)), index)
+        return layer_index
+
+    # For multi-extruder machines - track the tool so the proper settings get used in the pause.
+    def _track_tool_nr(self, data: str, pause_index: int) -> int:
+        # Only the last tool change in front of the pause matters so the sections are searched from the pause backwards
+        for num in range(pause_index - 1, 0, -1):
+            tool_match = None
+            for tool_match in _TOOL_LINE_RE.finditer(data[num]):
+                pass
+            if tool_match is not None:
+                return _parse_params(tool_match.group(0)).get("T")
+        return 0
@@ -18,6 +18,20 @@ import re
 from UM.Logger import Logger
 from enum import Enum
 
+# A StartUp line that looks like an extrusion with an X or Y move (a purge line)
+_PURGE_DETECT_RE = re.compile(r"^(?=[^\n]*G1)(?=[^\n]* E)(?=[^\n]* [XY])", re.MULTILINE)
+# A G0 line with both an X and a Y parameter (in either order) ahead of any comment
+_G0_XY_RE = re.compile(r"^G0(?=[^;\n]*[^\S\n]X(-?\d*\.?\d+))(?=[^;\n]*[^\S\n]Y(-?\d*\.?\d+))", re.MULTILINE)
+# The ending Gcode line that turns the hot end off
+_HOTEND_OFF_RE = re.compile(r"^M104[^\n]*S0", re.MULTILINE)
+# The retraction that 'Adjust Starting E' replaces, for firmware and for gcode retraction
+_FW_RETRACT_RE = re.compile(r"G10")
+_RETRACT_RE = re.compile(r"G1 F(\d*) E-(\d.*)")
+# The command part of a line that has a comment, without the padding in front of the ';'
+_CODE_RE = re.compile(r"^[^;\n]*?[^;\s](?=[ \t]*;)", re.MULTILINE)
+# The same plus its padding, and commented out commands that have a second comment.  The leading ';' of those is group 1.
+_COMMENT_GAP_RE = re.compile(r"^(;?)((?<=;)[^;\n]*?|[^;\n]+?)[ \t]*(?=;)", re.MULTILINE)
+
 
 class Location(str, Enum):
     LEFT = "left"
@@ -35,6 +49,31 @@ class Position(tuple, Enum):
     RIGHT_REAR = ("right", "rear")
 
 
+_PURGE_HEADER = ";TYPE:CUSTOM----------[Purge Lines]\n"
+_PURGE_FOOTER = "G0 F600 Z2 ; Move Z\n;---------------------[End of Purge]"
+_MOVE_DOWN = "G0 F600 Z0.3 ; Move down\n"
+# Elliptic travels to the layer start quadrant.  Each takes the travel speed and the 45° X / Y offsets on the bed edge.
+_ELLIPTIC_TRAVELS = {
+    Position.LEFT_FRONT: lambda tw, ox, oy: f"G0 F{tw} X-{ox} Z2 ; Move\nG0 Y-{oy} Z2 ; Move to start\n",
+    Position.LEFT_REAR: lambda tw, ox, oy: f"G0 F{tw} X-{ox} Z2 ; Ortho move\nG0 Y{oy} Z2 ; Ortho move\n",
+    Position.RIGHT_FRONT: lambda tw, ox, oy: f"G0 F{tw} X{ox} Z2 ; Ortho move\nG0 Y-{oy} Z2 ; Ortho move\n",
+    Position.RIGHT_REAR: lambda tw, ox, oy: f"G0 F{tw} X{ox} Z2 ; Ortho move\nG0 Y{oy} Z2 ; Ortho move\n"
+}
+# Keyed by (end of purge, layer start) for the cases that can follow the edge of the bed instead
+_ELLIPTIC_ARCS = {
+    (Position.LEFT_REAR, Position.LEFT_REAR): lambda tw, ox, oy: f"G2 X0 Y{oy} I{ox} J{oy} ; Move around to start\n"
+}
+# Touch the build plate between the layer start travels so the string can't follow the nozzle
+_NAIL_DOWN = "G0 F600 Z0 ; Nail down the string\nG0 F600 Z2 ; Move up\n"
+# Elliptic purges: the 45° corners the first arc runs between (as signs), its direction, the axis of the final moves, and where the nozzle ends up
+_ARC_LAYOUTS = {
+    Location.LEFT: dict(start=(-1, -1), stop=(-1, 1), first="G2", axis="X", end=Position.LEFT_FRONT),
+    Location.RIGHT: dict(start=(1, -1), stop=(1, 1), first="G3", axis="X", end=Position.RIGHT_REAR),
+    Location.BOTTOM: dict(start=(-1, -1), stop=(1, -1), first="G3", axis="Y", end=Position.LEFT_FRONT),
+    Location.TOP: dict(start=(1, 1), stop=(-1, 1), first="G3", axis="Y", end=Position.RIGHT_REAR)
+}
+
+
 class PurgeLinesAndUnload(Script):
 
     def __init__(self):
@@ -46,7 +85,6 @@ class PurgeLinesAndUnload(Script):
         # This will be True when there are more than 4 'machine_disallowed_areas'
         self.show_warning = False
         self.disallowed_areas = self.global_stack.getProperty("machine_disallowed_areas", "value")
-        self.extruder = self.global_stack.extruderList
         self.extruder_count = self.global_stack.getProperty("machine_extruder_count", "value")
         self.bed_shape = self.global_stack.getProperty("machine_shape", "value")
         self.origin_at_center = self.global_stack.getProperty("machine_center_is_zero", "value")
@@ -56,20 +94,24 @@ class PurgeLinesAndUnload(Script):
         self.machine_right = self.machine_width - 1.0
         self.machine_front = 1.0
         self.machine_back = self.machine_depth - 1.0
+        # Set per run by 'execute' and the procedures.  Declared here so a misspelled name can't quietly create a second attribute.
+        self.settings = {}
+        self.t0_has_offsets = False
+        self.nozzle_offset_x = 0.0
+        self.nozzle_offset_y = 0.0
+        self.start_x = 0
+        self.start_y = 0
 
     def initialize(self) -> None:
         super().initialize()
         # Get the StartUp Gcode from Cura and attempt to catch if it contains purge lines.  Message the user if an extrusion is in the startup.
         startup_gcode = self.global_stack.getProperty("machine_start_gcode", "value")
-        start_lines = startup_gcode.splitlines()
-        for line in start_lines:
-            if "G1" in line and " E" in line and (" X" in line or " Y" in line):
-                Message(title="[Purge Lines and Unload]",
-                        text="It appears that there are 'purge lines' in the StartUp Gcode. Using the 'Add Purge Lines' function of this script will comment them out.").show()
-                break
+        if _PURGE_DETECT_RE.search(startup_gcode):
+            Message(title="[Purge Lines and Unload]",
+                    text="It appears that there are 'purge lines' in the StartUp Gcode. Using the 'Add Purge Lines' function of this script will comment them out.").show()
         # 'is_rectangular' is used to disable half-length purge lines for elliptic beds.
-        self._instance.setProperty("is_rectangular", "value", True if self.global_stack.getProperty("machine_shape", "value") == "rectangular" else False)
-        self._instance.setProperty("move_to_prime_tower", "value", True if self.global_stack.getProperty("machine_extruder_count", "value") > 1 else False)
+        self._instance.setProperty("is_rectangular", "value", True if self.bed_shape == "rectangular" else False)
+        self._instance.setProperty("move_to_prime_tower", "value", True if self.extruder_count > 1 else False)
         # Set the default E adjustment
         self._instance.setProperty("adjust_e_loc_to", "value", -abs(round(float(self.extruder[0].getProperty("retraction_amount", "value")), 1)))
 
@@ -185,6 +227,18 @@ class PurgeLinesAndUnload(Script):
         }"""
 
     def execute(self, data):
+        # Mapping settings to corresponding methods
+        procedures = {
+            "add_purge_lines": self._add_purge_lines,
+            "move_to_prime_tower": self._move_to_prime_tower,
+            "move_to_start": self._move_to_start,
+            "adjust_starting_e": self._adjust_starting_e,
+            "enable_unload": self._unload_filament
+        }
+        enabled = [setting for setting in procedures if self.getSettingValueByKey(setting)]
+        # Pass the gcode straight through if none of the options are turned on
+        if not enabled:
+            return data
         # Exit if the Gcode has already been processed.
         for num in range(0, len(data)):
             layer = data[num].split("\n")
@@ -198,27 +252,21 @@ class PurgeLinesAndUnload(Script):
         # 't0_has_offsets' is used to exit 'Add Purge Lines' and 'Circle around...' because the script is not compatible with machines with the right nozzle as the primary nozzle.
         self.t0_has_offsets = False
         self.init_ext_nr = self._get_initial_tool()
+        self.settings = self._gather_settings()
         # Adjust the usable size of the bed per any 'disallowed areas'
         self._get_build_plate_extents()
         # The start location changes according to which quadrant the nozzle is in at the beginning
         self.end_purge_location = self._get_real_start_point(data[1])
 
-        # Mapping settings to corresponding methods
-        procedures = {
-            "add_purge_lines": self._add_purge_lines,
-            "move_to_prime_tower": self._move_to_prime_tower,
-            "move_to_start": self._move_to_start,
-            "adjust_starting_e": self._adjust_starting_e,
-            "enable_unload": self._unload_filament
-        }
         # Run selected procedures
-        for setting, method in procedures.items():
-            if self.getSettingValueByKey(setting):
-                method(data)
-        # Format the startup and ending gcodes
-        data[1] = self._format_string(data[1])
-        data[-1] = self._format_string(data[-1])
-        if self.getSettingValueByKey("add_purge_lines"):
+        for setting in enabled:
+            procedures[setting](data)
+        # Format the startup and ending gcodes.  Only 'Unload' touches the ending gcode and it is the only one that leaves the startup alone.
+        if enabled != ["enable_unload"]:
+            data[1] = self._format_string(data[1])
+        if "enable_unload" in enabled:
+            data[-1] = self._format_string(data[-1])
+        if "add_purge_lines" in enabled:
             if self.show_warning:
                 msg_text = ("The printer has ( " + str(len(self.disallowed_areas))
                             + " ) 'disallowed areas'.  That can cause the area available for the purge lines to be small.\nOpen the Gcode file for preview in Cura and check the purge line location to insure it is acceptable.")
@@ -269,8 +317,8 @@ class PurgeLinesAndUnload(Script):
             return first_section
         adjustment_lines = ""
         move_to_prime_present = False
-        prime_tower_x = self.global_stack.getProperty("prime_tower_position_x", "value")
-        prime_tower_y = self.global_stack.getProperty("prime_tower_position_y", "value")
+        prime_tower_x = self.settings["prime_tower_x"]
+        prime_tower_y = self.settings["prime_tower_y"]
         prime_tower_loc = self._prime_tower_quadrant(prime_tower_x, prime_tower_y)
         # Shortstop an error if Start Location comes through as None
         if self.end_purge_location is None:
@@ -331,11 +379,8 @@ class PurgeLinesAndUnload(Script):
 
         # Helper function to add G-code for moves
         def add_move(axis: str, position: float) -> None:
-            moves.append(
-                f"G0 F{self.speed_travel} {axis}{position} ; Start move\n"
-                f"G0 F600 Z0 ; Nail down the string\n"
-                f"G0 F600 Z2 ; Move up\n"
-            )
+            moves.append(f"G0 F{self.speed_travel} {axis}{position} ; Start move\n")
+            moves.append(_NAIL_DOWN)
 
         # Move to a corner
         if start_side == Location.LEFT:
@@ -425,249 +470,75 @@ class PurgeLinesAndUnload(Script):
             Message(title = "[Purge Lines and Unload]", text = "'Add Purge Lines' did not run because the assumed primary nozzle (T0) has tool offsets").show()
             return data
 
-        def calculate_purge_volume(line_width, purge_length, volume_per_mm):
-            return round((line_width * 0.3 * purge_length) * 1.25 / volume_per_mm, 5)
+        # Filament length per mm of purge line: a 0.3mm high line at 125% flow
+        purge_k = self.init_line_width * 0.375 / self.mm3_per_mm
 
         purge_location = self.getSettingValueByKey("purge_line_location")
         purge_extrusion_full = True if self.getSettingValueByKey("purge_line_length") == "purge_full" else False
-        purge_str = ";TYPE:CUSTOM----------[Purge Lines]\nG0 F600 Z2 ; Move up\nG92 E0 ; Reset extruder\n"
-        # Normal cartesian printer with origin at the left front corner
-        if self.bed_shape == "rectangular" and not self.origin_at_center:
-            if purge_location == Location.LEFT:
-                purge_len = int(self.machine_back - 20) if purge_extrusion_full else int(
-                    (self.machine_back - self.machine_front) / 2)
-                y_stop = int(self.machine_back - 10) if purge_extrusion_full else int(self.machine_depth / 2)
-                purge_volume = calculate_purge_volume(self.init_line_width, purge_len, self.mm3_per_mm)
-                purge_str = purge_str.replace("Lines", "Lines at MinX")
-                # Travel to the purge start
-                purge_str += f"G0 F{self.speed_travel} X{self.machine_left} Y{self.machine_front + 10} ; Move to start\n"
-                purge_str += f"G0 F600 Z0.3 ; Move down\n"
-                # Purge two lines
-                purge_str += f"G1 F{self.print_speed} X{self.machine_left} Y{y_stop} E{purge_volume} ; First line\n"
-                purge_str += f"G0 X{self.machine_left + 3} Y{y_stop} ; Move over\n"
-                purge_str += f"G1 F{self.print_speed} X{self.machine_left + 3} Y{self.machine_front + 10} E{round(purge_volume * 2, 5)} ; Second line\n"
-                # Retract if enabled
-                purge_str += f"G1 F{int(self.retract_speed)} E{round(purge_volume * 2 - self.retract_dist, 5)} ; Retract\n" if self.retraction_enable else ""
-                purge_str += "G0 F600 Z8 ; Move Up\nG4 S1 ; Wait for 1 second\n"
-                # Wipe
-                purge_str += f"G0 F{self.print_speed} X{self.machine_left + 3} Y{self.machine_front + 20} Z0.3 ; Slide over and down\n"
-                purge_str += f"G0 X{self.machine_left + 3} Y{self.machine_front + 35} ; Wipe\n"
-                self.end_purge_location = Position.LEFT_FRONT
-            elif purge_location == Location.RIGHT:
-                purge_len = int(self.machine_depth - 20) if purge_extrusion_full else int(
-                    (self.machine_back - self.machine_front) / 2)
-                y_stop = int(self.machine_front + 10) if purge_extrusion_full else int(self.machine_depth / 2)
-                purge_volume = calculate_purge_volume(self.init_line_width, purge_len, self.mm3_per_mm)
-                purge_str = purge_str.replace("Lines", "Lines at MaxX")
-                # Travel to the purge start
-                purge_str += f"G0 F{self.speed_travel} X{self.machine_right} ; Move\nG0 Y{self.machine_back - 10} ; Move\n"
-                purge_str += f"G0 F600 Z0.3 ; Move down\n"
-                # Purge two lines
-                purge_str += f"G1 F{self.print_speed} X{self.machine_right} Y{y_stop} E{purge_volume} ; First line\n"
-                purge_str += f"G0 X{self.machine_right - 3} Y{y_stop} ; Move over\n"
-                purge_str += f"G1 F{self.print_speed} X{self.machine_right - 3} Y{self.machine_back - 10} E{purge_volume * 2} ; Second line\n"
-                # Retract if enabled
-                purge_str += f"G1 F{int(self.retract_speed)} E{round(purge_volume * 2 - self.retract_dist, 5)} ; Retract\n" if self.retraction_enable else ""
-                purge_str += "G0 F600 Z8 ; Move Up\nG4 S1 ; Wait for 1 second\n"
-                # Wipe
-                purge_str += f"G0 F{self.print_speed} X{self.machine_right - 3} Y{self.machine_back - 20} Z0.3 ; Slide over and down\n"
-                purge_str += f"G0 X{self.machine_right - 3} Y{self.machine_back - 35} ; Wipe\n"
-                self.end_purge_location = Position.RIGHT_REAR
-            elif purge_location == Location.BOTTOM:
-                purge_len = int(self.machine_width) - self.nozzle_offset_x - 20 if purge_extrusion_full else int(
-                    (self.machine_right - self.machine_left) / 2)
-                x_stop = int(self.machine_right - 10) if purge_extrusion_full else int(self.machine_width / 2)
-                purge_volume = calculate_purge_volume(self.init_line_width, purge_len, self.mm3_per_mm)
-                purge_str = purge_str.replace("Lines", "Lines at MinY")
-                # Travel to the purge start
-                purge_str += f"G0 F{self.speed_travel} X{self.machine_left + 10} Y{self.machine_front} ; Move to start\n"
-                purge_str += f"G0 F600 Z0.3 ; Move down\n"
-                # Purge two lines
-                purge_str += f"G1 F{self.print_speed} X{x_stop} Y{self.machine_front} E{purge_volume} ; First line\n"
-                purge_str += f"G0 X{x_stop} Y{self.machine_front + 3} ; Move over\n"
-                purge_str += f"G1 F{self.print_speed} X{self.machine_left + 10} Y{self.machine_front + 3} E{purge_volume * 2} ; Second line\n"
-                # Retract if enabled
-                purge_str += f"G1 F{int(self.retract_speed)} E{round(purge_volume * 2 - self.retract_dist, 5)} ; Retract\n" if self.retraction_enable else ""
-                purge_str += "G0 F600 Z8 ; Move Up\nG4 S1 ; Wait for 1 second\n"
-                # Wipe
-                purge_str += f"G0 F{self.print_speed} X{self.machine_left + 20} Y{self.machine_front + 3} Z0.3 ; Slide over and down\n"
-                purge_str += f"G0 X{self.machine_left + 35} Y{self.machine_front + 3} ; Wipe\n"
-                self.end_purge_location = Position.LEFT_FRONT
-            elif purge_location == Location.TOP:
-                purge_len = int(self.machine_width - 20) if purge_extrusion_full else int(
-                    (self.machine_right - self.machine_left) / 2)
-                x_stop = int(self.machine_left + 10) if purge_extrusion_full else int(self.machine_width / 2)
-                purge_volume = calculate_purge_volume(self.init_line_width, purge_len, self.mm3_per_mm)
-                purge_str = purge_str.replace("Lines", "Lines at MaxY")
-                # Travel to the purge start
-                purge_str += f"G0 F{self.speed_travel} Y{self.machine_back} ; Ortho Move to back\n"
-                purge_str += f"G0 X{self.machine_right - 10} ; Ortho move to start\n"
-                purge_str += f"G0 F600 Z0.3 ; Move down\n"
-                # Purge two lines
-                purge_str += f"G1 F{self.print_speed} X{x_stop} Y{self.machine_back} E{purge_volume} ; First line\n"
-                purge_str += f"G0 X{x_stop} Y{self.machine_back - 3} ; Move over\n"
-                purge_str += f"G1 F{self.print_speed} X{self.machine_right - 10} Y{self.machine_back - 3} E{purge_volume * 2} ; Second line\n"
-                # Retract if enabled
-                purge_str += f"G1 F{int(self.retract_speed)} E{round(purge_volume * 2 - self.retract_dist, 5)} ; Retract\n" if self.retraction_enable else ""
-                purge_str += "G0 F600 Z8 ; Move Up\nG4 S1 ; Wait 1 second\n"
-                # Wipe
-                purge_str += f"G0 F{self.print_speed} X{self.machine_right - 20} Y{self.machine_back - 3} Z0.3 ; Slide over and down\n"
-                purge_str += f"G0 X{self.machine_right - 35} Y{self.machine_back - 3} ; Wipe\n"
-                self.end_purge_location = Position.RIGHT_REAR
-        # Some cartesian printers (BIBO, Weedo, MethodX, etc.) are Origin at Center
-        elif self.bed_shape == "rectangular" and self.origin_at_center:
-            if purge_location == Location.LEFT:
-                purge_len = int(self.machine_back - self.machine_front - 20) if purge_extrusion_full else abs(
-                    int(self.machine_front - 10))
-                y_stop = int(self.machine_back - 10) if purge_extrusion_full else 0
-                purge_volume = calculate_purge_volume(self.init_line_width, purge_len, self.mm3_per_mm)
-                # Travel to the purge start
-                purge_str += f"G0 F{self.speed_travel} X{self.machine_left} Y{self.machine_front + 10} ; Move to start\n"
-                purge_str += f"G0 F600 Z0.3 ; Move down\n"
-                # Purge two lines
-                purge_str += f"G1 F{self.print_speed} X{self.machine_left} Y{y_stop} E{purge_volume} ; First line\n"
-                purge_str += f"G0 X{self.machine_left + 3} Y{y_stop} ; Move over\n"
-                purge_str += f"G1 F{self.print_speed} X{self.machine_left + 3} Y{self.machine_front + 10} E{round(purge_volume * 2, 5)} ; Second line\n"
-                # Retract if enabled
-                purge_str += f"G1 F{int(self.retract_speed)} E{round(purge_volume * 2 - self.retract_dist, 5)} ; Retract\n" if self.retraction_enable else ""
-                purge_str += "G0 F600 Z8 ; Move Up\nG4 S1 ; Wait for 1 second\n"
-                # Wipe
-                purge_str += f"G0 F{self.print_speed} X{self.machine_left + 3} Y{self.machine_front + 20} Z0.3 ; Slide over and down\n"
-                purge_str += f"G0 X{self.machine_left + 3} Y{self.machine_front + 35} ; Wipe\n"
-                self.end_purge_location = Position.LEFT_FRONT
-            elif purge_location == Location.RIGHT:
-                purge_len = int(self.machine_back - 20) if purge_extrusion_full else int(
-                    (self.machine_back - self.machine_front) / 2)
-                y_stop = int(self.machine_front + 10) if purge_extrusion_full else 0
-                purge_volume = calculate_purge_volume(self.init_line_width, purge_len, self.mm3_per_mm)
-                # Travel to the purge start
-                purge_str += f"G0 F{self.speed_travel} X{self.machine_right} Z2 ; Move\nG0 Y{self.machine_back - 10} Z2 ; Move to start\n"
-                purge_str += f"G0 F600 Z0.3 ; Move down\n"
-                # Purge two lines
-                purge_str += f"G1 F{self.print_speed} X{self.machine_right} Y{y_stop} E{purge_volume} ; First line\n"
-                purge_str += f"G0 X{self.machine_right - 3} Y{y_stop} ; Move over\n"
-                purge_str += f"G1 F{self.print_speed} X{self.machine_right - 3} Y{self.machine_back - 10} E{purge_volume * 2} ; Second line\n"
-                # Retract if enabled
-                purge_str += f"G1 F{int(self.retract_speed)} E{round(purge_volume * 2 - self.retract_dist, 5)} ; Retract\n" if self.retraction_enable else ""
-                purge_str += "G0 F600 Z8 ; Move Up\nG4 S1 ; Wait for 1 second\n"
-                # Wipe
-                purge_str += f"G0 F{self.print_speed} X{self.machine_right - 3} Y{self.machine_back - 20} Z0.3 ; Slide over and down\n"
-                purge_str += f"G0 F{self.speed_travel} X{self.machine_right - 3} Y{self.machine_back - 35} ; Wipe\n"
-                self.end_purge_location = Position.RIGHT_REAR
-            elif purge_location == Location.BOTTOM:
-                purge_len = int(self.machine_right - self.machine_left - 20) if purge_extrusion_full else int(
-                    (self.machine_right - self.machine_left) / 2)
-                x_stop = int(self.machine_right - 10) if purge_extrusion_full else 0
-                purge_volume = calculate_purge_volume(self.init_line_width, purge_len, self.mm3_per_mm)
-                # Travel to the purge start
-                purge_str += f"G0 F{self.speed_travel} X{self.machine_left + 10} Z2 ; Move\nG0 Y{self.machine_front} Z2 ; Move to start\n"
-                purge_str += f"G0 F600 Z0.3 ; Move down\n"
-                # Purge two lines
-                purge_str += f"G1 F{self.print_speed} X{x_stop} Y{self.machine_front} E{purge_volume} ; First line\n"
-                purge_str += f"G0 X{x_stop} Y{self.machine_front + 3} ; Move over\n"
-                purge_str += f"G1 F{self.print_speed} X{self.machine_left + 10} Y{self.machine_front + 3} E{purge_volume * 2} ; Second line\n"
-                # Retract if enabled
-                purge_str += f"G1 F{int(self.retract_speed)} E{round(purge_volume * 2 - self.retract_dist, 5)} ; Retract\n" if self.retraction_enable else ""
-                purge_str += "G0 F600 Z8 ; Move Up\nG4 S1 ; Wait for 1 second\n"
-                # Wipe
-                purge_str += f"G0 F{self.print_speed} X{self.machine_left + 20} Y{self.machine_front + 3} Z0.3 ; Slide over and down\n"
-                purge_str += f"G0 F{self.print_speed} X{self.machine_left + 35} Y{self.machine_front + 3} ; Wipe\n"
-                self.end_purge_location = Position.LEFT_FRONT
-            elif purge_location == Location.TOP:
-                purge_len = int(self.machine_right - self.machine_left - 20) if purge_extrusion_full else abs(
-                    int(self.machine_right - 10))
-                x_stop = int(self.machine_left + 10) if purge_extrusion_full else 0
-                purge_volume = calculate_purge_volume(self.init_line_width, purge_len, self.mm3_per_mm)
-                # Travel to the purge start
-                purge_str += f"G0 F{self.speed_travel} Y{self.machine_back} Z2; Ortho Move to back\n"
-                purge_str += f"G0 X{self.machine_right - 10} Z2 ; Ortho Move to start\n"
-                purge_str += f"G0 F600 Z0.3 ; Move down\n"
-                # Purge two lines
-                purge_str += f"G1 F{self.print_speed} X{x_stop} Y{self.machine_back} E{purge_volume} ; First line\n"
-                purge_str += f"G0 X{x_stop} Y{self.machine_back - 3} ; Move over\n"
-                purge_str += f"G1 F{self.print_speed} X{self.machine_right - 10} Y{self.machine_back - 3} E{purge_volume * 2} ; Second line\n"
-                # Retract if enabled
-                purge_str += f"G1 F{int(self.retract_speed)} E{round(purge_volume * 2 - self.retract_dist, 5)} ; Retract\n" if self.retraction_enable else ""
-                purge_str += "G0 F600 Z8 ; Move Up\nG4 S1 ; Wait for 1 second\n"
-                # Wipe
-                purge_str += f"G0 F{self.print_speed} X{self.machine_right - 20} Y{self.machine_back - 3} Z0.3 ; Slide over and down\n"
-                purge_str += f"G0 F{self.print_speed} X{self.machine_right - 35} Y{self.machine_back - 3} ; Wipe\n"
-                self.end_purge_location = Position.RIGHT_REAR
+        parts = [_PURGE_HEADER, "G0 F600 Z2 ; Move up\nG92 E0 ; Reset extruder\n"]
+        if self.bed_shape == "rectangular":
+            left, right = self.machine_left, self.machine_right
+            front, back = self.machine_front, self.machine_back
+            half_w = self.machine_width / 2
+            half_d = self.machine_depth / 2
+            center = bool(self.origin_at_center)
+            # Origin at center printers travel to the start with a Z2 on each move
+            z2 = " Z2" if center else ""
+            # Where the lines run, which way the second line steps over, and where the nozzle ends up.  'travel' is the move to the start,
+            # 'wipe_f' is the feed word on the wipe, and 'wait' is the comment on the dwell.
+            geometry = {
+                Location.LEFT: dict(axis="Y", fixed=left, over=3, edge=front, step=1, tag="MinX", end=Position.LEFT_FRONT,
+                    travel=f"G0 F{self.speed_travel} X{left:g} Y{front + 10:g} ; Move to start\n",
+                    wipe_f="", wait="Wait for 1 second"),
+                Location.RIGHT: dict(axis="Y", fixed=right, over=-3, edge=back, step=-1, tag="MaxX", end=Position.RIGHT_REAR,
+                    travel=f"G0 F{self.speed_travel} X{right:g}{z2} ; Move\nG0 Y{back - 10:g}{z2} ; Move{' to start' if center else ''}\n",
+                    wipe_f=f"F{self.speed_travel} " if center else "", wait="Wait for 1 second"),
+                Location.BOTTOM: dict(axis="X", fixed=front, over=3, edge=left, step=1, tag="MinY", end=Position.LEFT_FRONT,
+                    travel=f"G0 F{self.speed_travel} X{left + 10:g} Z2 ; Move\nG0 Y{front:g} Z2 ; Move to start\n" if center else f"G0 F{self.speed_travel} X{left + 10:g} Y{front:g} ; Move to start\n",
+                    wipe_f=f"F{self.print_speed} " if center else "", wait="Wait for 1 second"),
+                Location.TOP: dict(axis="X", fixed=back, over=-3, edge=right, step=-1, tag="MaxY", end=Position.RIGHT_REAR,
+                    travel=f"G0 F{self.speed_travel} Y{back:g}{z2} ; Ortho Move to back\nG0 X{right - 10:g}{z2} ; Ortho {'Move' if center else 'move'} to start\n",
+                    wipe_f=f"F{self.print_speed} " if center else "", wait="Wait for 1 second" if center else "Wait 1 second")
+            }
+            # (full purge length, half purge length, full length stop) for each origin.  Half length purges stop at the middle of the bed.
+            lengths = {
+                (Location.LEFT, False): (back - 20, (back - front) / 2, back - 10),
+                (Location.RIGHT, False): (self.machine_depth - 20, (back - front) / 2, front + 10),
+                (Location.BOTTOM, False): (self.machine_width - self.nozzle_offset_x - 20, (right - left) / 2, right - 10),
+                (Location.TOP, False): (self.machine_width - 20, (right - left) / 2, left + 10),
+                (Location.LEFT, True): (back - front - 20, abs(front - 10), back - 10),
+                (Location.RIGHT, True): (back - 20, (back - front) / 2, front + 10),
+                (Location.BOTTOM, True): (right - left - 20, (right - left) / 2, right - 10),
+                (Location.TOP, True): (right - left - 20, abs(right - 10), left + 10)
+            }
+            cfg = geometry[purge_location]
+            full_len, half_len, full_stop = lengths[(purge_location, center)]
+            if purge_extrusion_full:
+                purge_len, cfg["stop"] = full_len, full_stop
+            else:
+                purge_len = half_len
+                cfg["stop"] = 0 if center else (half_d if cfg["axis"] == "Y" else half_w)
+            purge_volume = purge_k * purge_len
+            # Only the origin at front left header says which side the lines are on
+            if not center:
+                parts[0] = parts[0].replace("Lines", "Lines at " + cfg["tag"])
+            self._emit_rect_purge(parts, cfg, purge_volume)
+            self.end_purge_location = cfg["end"]
         # Elliptic printers with Origin at Center
         elif self.bed_shape == "elliptic":
             if purge_location in [Location.LEFT, Location.RIGHT]:
                 radius_1 = round((self.machine_width / 2) - 1, 2)
             else:  # For purge_location in [Location.BOTTOM, Location.TOP]
                 radius_1 = round((self.machine_depth / 2) - 1, 2)
-            purge_len = int(radius_1) * math.pi / 4
-            purge_volume = calculate_purge_volume(self.init_line_width, purge_len, self.mm3_per_mm)
-            if purge_location == Location.LEFT:
-                # Travel to the purge start
-                purge_str += f"G0 F{self.speed_travel} X-{round(radius_1 * .707, 2)} Y-{round(radius_1 * .707, 2)} ; Travel\n"
-                purge_str += f"G0 F600 Z0.3 ; Move down\n"
-                # Purge two arcs
-                purge_str += f"G2 F{self.print_speed} X-{round(radius_1 * .707, 2)} Y{round(radius_1 * .707, 2)} I{round(radius_1 * .707, 2)} J{round(radius_1 * .707, 2)} E{purge_volume} ; First Arc\n"
-                purge_str += f"G0 X-{round((radius_1 - 3) * .707, 2)} Y{round((radius_1 - 3) * .707, 2)} ; Move Over\n"
-                purge_str += f"G3 F{self.print_speed} X-{round((radius_1 - 3) * .707, 2)} Y-{round((radius_1 - 3) * .707, 2)} I{round((radius_1 - 3) * .707, 2)} J-{round((radius_1 - 3) * .707, 2)} E{purge_volume * 2} ; Second Arc\n"
-                purge_str += f"G1 X-{round((radius_1 - 3) * .707 - 25, 2)} E{round(purge_volume * 2 + 1, 5)} ; Move Over\n"
-                # Retract if enabled
-                purge_str += f"G1 F{int(self.retract_speed)} E{round((purge_volume * 2 + 1) - self.retract_dist, 5)} ; Retract\n" if self.retraction_enable else ""
-                purge_str += "G0 F600 Z5 ; Move Up\nG4 S1 ; Wait 1 Second\n"
-                # Wipe
-                purge_str += f"G0 F{self.print_speed} X-{round((radius_1 - 3) * .707 - 15, 2)} Z0.3 ; Slide Over\n"
-                purge_str += f"G0 F{self.print_speed} X-{round((radius_1 - 3) * .707, 2)} ; Wipe\n"
-                self.end_purge_location = Position.LEFT_FRONT
-            elif purge_location == Location.RIGHT:
-                # Travel to the purge start
-                purge_str += f"G0 F{self.speed_travel} X{round(radius_1 * .707, 2)} Y-{round(radius_1 * .707, 2)} ; Travel\n"
-                purge_str += f"G0 F600 Z0.3 ; Move down\n"
-                # Purge two arcs
-                purge_str += f"G3 F{self.print_speed} X{round(radius_1 * .707, 2)} Y{round(radius_1 * .707, 2)} I-{round(radius_1 * .707, 2)} J{round(radius_1 * .707, 2)} E{purge_volume} ; First Arc\n"
-                purge_str += f"G0 X{round((radius_1 - 3) * .707, 2)} Y{round((radius_1 - 3) * .707, 2)} ; Move Over\n"
-                purge_str += f"G2 F{self.print_speed} X{round((radius_1 - 3) * .707, 2)} Y-{round((radius_1 - 3) * .707, 2)} I-{round((radius_1 - 3) * .707, 2)} J-{round((radius_1 - 3) * .707, 2)} E{purge_volume * 2} ; Second Arc\n"
-                purge_str += f"G1 X{round((radius_1 - 3) * .707 - 25, 2)} E{round(purge_volume * 2 + 1, 5)} ; Move Over\n"
-                # Retract if enabled
-                purge_str += f"G1 F{int(self.retract_speed)} E{round((purge_volume * 2 + 1) - self.retract_dist, 5)} ; Retract\n" if self.retraction_enable else ""
-                purge_str += "G0 F600 Z5 ; Move Up\nG4 S1 ; Wait 1 Second\n"
-                # Wipe
-                purge_str += f"G0 F{self.print_speed} X{round((radius_1 - 3) * .707 - 15, 2)} Z0.3 ; Slide Over\n"
-                purge_str += f"G0 F{self.print_speed} X{round((radius_1 - 3) * .707, 2)} ; Wipe\n"
-                self.end_purge_location = Position.RIGHT_REAR
-            elif purge_location == Location.BOTTOM:
-                # Travel to the purge start
-                purge_str += f"G0 F{self.speed_travel} X-{round(radius_1 * .707, 2)} Y-{round(radius_1 * .707, 2)} ; Travel\n"
-                purge_str += f"G0 F600 Z0.3 ; Move down\n"
-                # Purge two arcs
-                purge_str += f"G3 F{self.print_speed} X{round(radius_1 * .707, 2)} Y-{round(radius_1 * .707, 2)} I{round(radius_1 * .707, 2)} J{round(radius_1 * .707, 2)} E{purge_volume} ; First Arc\n"
-                purge_str += f"G0 X{round((radius_1 - 3) * .707, 2)} Y-{round((radius_1 - 3) * .707, 2)} ; Move Over\n"
-                purge_str += f"G2 F{self.print_speed} X-{round((radius_1 - 3) * .707, 2)} Y-{round((radius_1 - 3) * .707, 2)} I-{round((radius_1 - 3) * .707, 2)} J{round((radius_1 - 3) * .707, 2)} E{purge_volume * 2} ; Second Arc\n"
-                purge_str += f"G1 Y-{round((radius_1 - 3) * .707 - 25, 2)} E{round(purge_volume * 2 + 1, 5)} ; Move Over\n"
-                # Retract if enabled
-                purge_str += f"G1 F{int(self.retract_speed)} E{round((purge_volume * 2 + 1) - self.retract_dist, 5)} ; Retract\n" if self.retraction_enable else ""
-                purge_str += "G0 F600 Z5 ; Move Up\nG4 S1 ; Wait 1 Second\n"
-                # Wipe
-                purge_str += f"G0 F{self.print_speed} Y-{round((radius_1 - 3) * .707 - 15, 2)} Z0.3 ; Slide Over\n"
-                purge_str += f"G0 F{self.print_speed} Y-{round((radius_1 - 3) * .707, 2)} ; Wipe\n"
-                self.end_purge_location = Position.LEFT_FRONT
-            elif purge_location == Location.TOP:
-                # Travel to the purge start
-                purge_str += f"G0 F{self.speed_travel} X{round(radius_1 * .707, 2)} Y{round(radius_1 * .707, 2)} ; Travel\n"
-                purge_str += f"G0 F600 Z0.3 ; Move down\n"
-                # Purge two arcs
-                purge_str += f"G3 F{self.print_speed} X-{round(radius_1 * .707, 2)} Y{round(radius_1 * .707, 2)} I-{round(radius_1 * .707, 2)} J-{round(radius_1 * .707, 2)} E{purge_volume} ; First Arc\n"
-                purge_str += f"G0 X-{round((radius_1 - 3) * .707, 2)} Y{round((radius_1 - 3) * .707, 2)} ; Move Over\n"
-                purge_str += f"G2 F{self.print_speed} X{round((radius_1 - 3) * .707, 2)} Y{round((radius_1 - 3) * .707, 2)} I{round((radius_1 - 3) * .707, 2)} J-{round((radius_1 - 3) * .707, 2)} E{purge_volume * 2} ; Second Arc\n"
-                purge_str += f"G1 Y{round((radius_1 - 3) * .707 - 25, 2)} E{round(purge_volume * 2 + 1, 5)} ; Move Over\n"
-                # Retract if enabled
-                purge_str += f"G1 F{int(self.retract_speed)} E{round((purge_volume * 2 + 1) - self.retract_dist, 5)} ; Retract\n" if self.retraction_enable else ""
-                purge_str += "G0 F600 Z5\nG4 S1 ; Wait 1 Second\n"
-                # Wipe
-                purge_str += f"G0 F{self.print_speed} Y{round((radius_1 - 3) * .707 - 15, 2)} Z0.3 ; Slide Over\n"
-                purge_str += f"G0 F{self.print_speed} Y{round((radius_1 - 3) * .707, 2)} ; Wipe\n"
-                self.end_purge_location = Position.RIGHT_REAR
-
-        # Common ending for purge_str
-        purge_str += "G0 F600 Z2 ; Move Z\n;---------------------[End of Purge]"
+            purge_len = radius_1 * math.pi / 4
+            purge_volume = purge_k * purge_len
+            cfg = _ARC_LAYOUTS[purge_location]
+            self._emit_arc_purge(parts, cfg, purge_volume, radius_1)
+            self.end_purge_location = cfg["end"]
+
+        # Common ending for the purge lines
+        parts.append(_PURGE_FOOTER)
+        purge_str = "".join(parts)
 
         # Comment out any existing purge lines in data
         startup = data[1].split("\n")
@@ -682,95 +553,117 @@ class PurgeLinesAndUnload(Script):
                     break
         data[1] = "\n".join(startup)
 
-        # Find the insertion location in data
-        purge_str = self._format_string(purge_str)
-        startup_section = data[1].split("\n")
-        insert_index = len(startup_section) - 1
-        for num in range(len(startup_section) - 1, 0, -1):
-            # In Absolute Extrusion mode - insert above the last G92 E0 line
-            if "G92 E0" in startup_section[num]:
-                insert_index = num
-                break
-            # In Relative Extrusion mode - insert above the M83 line
-            elif "M83" in startup_section[num]:
-                insert_index = num
-                break
-        startup_section.insert(insert_index, purge_str)
-        data[1] = "\n".join(startup_section)
+        # Find the insertion location in data.  'execute' formats the whole StartUp afterwards.
+        # Insert above the last G92 E0 line (Absolute Extrusion) or M83 line (Relative Extrusion).  The first line is never used.
+        last_hit = max(data[1].rfind("G92 E0"), data[1].rfind("M83"))
+        pos = data[1].rfind("\n", 0, last_hit) + 1 if last_hit > -1 else 0
+        if pos == 0:
+            # Default to above the last line
+            pos = data[1].rfind("\n") + 1
+        data[1] = data[1][:pos] + purge_str + "\n" + data[1][pos:]
         return data
 
+    # Two purge lines along 'axis' at 'fixed' on the other axis, then the retraction and the wipe.  The lines start 10mm in from 'edge'
+    # and 'step' is the direction from there towards 'stop'.
+    def _emit_rect_purge(self, parts: list, cfg: dict, purge_volume: float) -> None:
+        axis, fixed, edge, stop, step = cfg["axis"], cfg["fixed"], cfg["edge"], cfg["stop"], cfg["step"]
+        start = edge + step * 10
+        over = fixed + cfg["over"]
+        print_f, retract_f = f"F{self.print_speed}", f"F{int(self.retract_speed)}"
+
+        def point(along, across) -> str:
+            return f"X{along:g} Y{across:g}" if axis == "X" else f"X{across:g} Y{along:g}"
+
+        # Travel to the purge start
+        parts.append(cfg["travel"])
+        parts.append(_MOVE_DOWN)
+        # Purge two lines
+        parts.append(f"G1 {print_f} {point(stop, fixed)} E{purge_volume:.5f} ; First line\n")
+        parts.append(f"G0 {point(stop, over)} ; Move over\n")
+        parts.append(f"G1 {print_f} {point(start, over)} E{purge_volume * 2:.5f} ; Second line\n")
+        # Retract if enabled
+        if self.retraction_enable:
+            parts.append(f"G1 {retract_f} E{purge_volume * 2 - self.retract_dist:.5f} ; Retract\n")
+        parts.append(f"G0 F600 Z8 ; Move Up\nG4 S1 ; {cfg['wait']}\n")
+        # Wipe
+        parts.append(f"G0 {print_f} {point(edge + step * 20, over)} Z0.3 ; Slide over and down\n")
+        parts.append(f"G0 {cfg['wipe_f']}{point(edge + step * 35, over)} ; Wipe\n")
+
+    # Two 90° arcs around the edge of an elliptic bed, then the retraction and the wipe.  The second arc runs back inside the first.
+    def _emit_arc_purge(self, parts: list, cfg: dict, purge_volume: float, radius_1: float) -> None:
+        (sx, sy), (ex, ey) = cfg["start"], cfg["stop"]
+        axis = cfg["axis"]
+        second = "G3" if cfg["first"] == "G2" else "G2"
+        sign = sx if axis == "X" else sy
+        print_f, retract_f = f"F{self.print_speed}", f"F{int(self.retract_speed)}"
+        # The arc end points sit at 45° so the same offsets appear in every arc command
+        r707 = radius_1 * .707
+        rm3_707 = (radius_1 - 3) * .707
+        rm3_m25 = rm3_707 - 25
+        rm3_m15 = rm3_707 - 15
+        # Travel to the purge start
+        parts.append(f"G0 F{self.speed_travel} X{sx * r707:.2f} Y{sy * r707:.2f} ; Travel\n")
+        parts.append(_MOVE_DOWN)
+        # Purge two arcs.  I and J point back to the bed center.
+        parts.append(f"{cfg['first']} {print_f} X{ex * r707:.2f} Y{ey * r707:.2f} I{-sx * r707:.2f} J{-sy * r707:.2f} E{purge_volume:.5f} ; First Arc\n")
+        parts.append(f"G0 X{ex * rm3_707:.2f} Y{ey * rm3_707:.2f} ; Move Over\n")
+        parts.append(f"{second} {print_f} X{sx * rm3_707:.2f} Y{sy * rm3_707:.2f} I{-ex * rm3_707:.2f} J{-ey * rm3_707:.2f} E{purge_volume * 2:.5f} ; Second Arc\n")
+        parts.append(f"G1 {axis}{sign * rm3_m25:.2f} E{purge_volume * 2 + 1:.5f} ; Move Over\n")
+        # Retract if enabled
+        if self.retraction_enable:
+            parts.append(f"G1 {retract_f} E{purge_volume * 2 + 1 - self.retract_dist:.5f} ; Retract\n")
+        parts.append("G0 F600 Z5 ; Move Up\nG4 S1 ; Wait 1 Second\n")
+        # Wipe
+        parts.append(f"G0 {print_f} {axis}{sign * rm3_m15:.2f} Z0.3 ; Slide Over\n")
+        parts.append(f"G0 {print_f} {axis}{sign * rm3_707:.2f} ; Wipe\n")
+
     # Travel moves around the bed periphery to keep strings from crossing the footprint of the model.
     def _move_to_start(self, data: str) -> str:
         if self.t0_has_offsets:
             data[0] += ";  [Purge Lines and Unload] 'Circle Around to Layer Start' did not run because the assumed primary nozzle (T0) has tool offsets.\n"
             Message(title = "[Purge Lines and Unload]", text = "'Circle Around to Layer Start' did not run because the assumed primary nozzle (T0) has tool offsets.").show()
             return data
-        self.start_x = None
-        self.start_y = None
-        move_str = None
-        layer = data[2].split("\n")
-        for line in layer:
-            if line.startswith("G0") and " X" in line and " Y" in line:
-                self.start_x = self.getValue(line, "X")
-                self.start_y = self.getValue(line, "Y")
-                break
-        self.start_x = self.start_x or 0
-        self.start_y = self.start_y or 0
+        moves = []
+        # The first travel with both an X and a Y in layer 0.  The values are kept as text and converted where they are compared.
+        start_move = _G0_XY_RE.search(data[2])
+        self.start_x = start_move.group(1) if start_move else 0
+        self.start_y = start_move.group(2) if start_move else 0
         if self.end_purge_location is None:
             self.end_purge_location = Position.LEFT_FRONT
-        midpoint_x = self.machine_width / 2
-        midpoint_y = self.machine_depth / 2
-        if not self.origin_at_center:
-            if float(self.start_x) <= float(midpoint_x):
-                x_target = Location.LEFT
-            else:
-                x_target = Location.RIGHT
-            if float(self.start_y) <= float(midpoint_y):
-                y_target = Location.FRONT
-            else:
-                y_target = Location.REAR
-        else:
-            if float(self.start_x) <= 0:
-                x_target = Location.LEFT
-            else:
-                x_target = Location.RIGHT
-            if float(self.start_y) <= 0:
-                y_target = Location.FRONT
-            else:
-                y_target = Location.REAR
-        target_location = (x_target, y_target)
+        # The layer start quadrant, measured from the middle of the bed
+        midpoint_x, midpoint_y = (0.0, 0.0) if self.origin_at_center else (self.machine_width / 2, self.machine_depth / 2)
+        x_target = Location.LEFT if float(self.start_x) <= midpoint_x else Location.RIGHT
+        y_target = Location.FRONT if float(self.start_y) <= midpoint_y else Location.REAR
+        target_location = Position((x_target, y_target))
         if self.bed_shape == "rectangular":
-            move_str = self._move_to_location("Layer Start", target_location)
+            moves.append(self._move_to_location("Layer Start", target_location))
         elif self.bed_shape == "elliptic" and self.origin_at_center:
-            move_str = f";MESH:NONMESH---------[Travel to Layer Start]\nG0 F600 Z2 ; Move up\n"
-            radius = self.machine_width / 2
-            offset_sin = round(2 ** .5 / 2 * radius, 2)
-            if target_location == Position.LEFT_FRONT:
-                move_str += f"G0 F{self.speed_travel} X-{offset_sin} Z2 ; Move\nG0 Y-{offset_sin} Z2 ; Move to start\n"
-            elif target_location == Position.LEFT_REAR:
-                if self.end_purge_location == Position.LEFT_REAR:
-                    move_str += f"G2 X0 Y{offset_sin} I{offset_sin} J{offset_sin} ; Move around to start\n"
-                else:
-                    move_str += f"G0 F{self.speed_travel} X-{offset_sin} Z2 ; Ortho move\nG0 Y{offset_sin} Z2 ; Ortho move\n"
-            elif target_location == Position.RIGHT_FRONT:
-                move_str += f"G0 F{self.speed_travel} X{offset_sin} Z2 ; Ortho move\nG0 Y-{offset_sin} Z2 ; Ortho move\n"
-            elif target_location == Position.RIGHT_REAR:
-                move_str += f"G0 F{self.speed_travel} X{offset_sin} Z2 ; Ortho move\nG0 Y{offset_sin} Z2 ; Ortho move\n"
-        move_str += ";---------------------[End of layer start travels]"
+            moves.append(";MESH:NONMESH---------[Travel to Layer Start]\nG0 F600 Z2 ; Move up\n")
+            # The 45° points on the edge of the bed.  The Y offset comes from the bed depth so non-circular beds are handled.
+            offset_x = round(2 ** .5 / 2 * self.machine_width / 2, 2)
+            offset_y = round(2 ** .5 / 2 * self.machine_depth / 2, 2)
+            # A purge that ended in the same corner can arc around the edge; otherwise use the orthogonal moves
+            travel = _ELLIPTIC_ARCS.get((self.end_purge_location, target_location), _ELLIPTIC_TRAVELS[target_location])
+            moves.append(travel(self.speed_travel, offset_x, offset_y))
+        moves.append(";---------------------[End of layer start travels]")
+        move_str = "".join(moves)
         # Add the move_str to the end of the StartUp section and move 'LAYER_COUNT' to the end.
-        startup = data[1].split("\n")
-        move_str = self._format_string(move_str)
         if move_str.startswith("\n"):
             move_str = move_str[1:]
-        startup.append(move_str)
+        startup = data[1]
         # Move the 'LAYER_COUNT' line so it's at the end of data[1]
-        for index, line in enumerate(startup):
-            if "LAYER_COUNT" in line:
-                lay_count = startup.pop(index) + "\n"
-                startup.append(lay_count)
-                break
-
-        data[1] = "\n".join(startup)
+        count_pos = startup.find("LAYER_COUNT")
+        if count_pos == -1:
+            data[1] = startup + "\n" + move_str
+        else:
+            line_start = startup.rfind("\n", 0, count_pos) + 1
+            line_end = startup.find("\n", count_pos)
+            if line_end == -1:
+                count_line, others = startup[line_start:], startup[:max(line_start - 1, 0)]
+            else:
+                count_line, others = startup[line_start:line_end], startup[:line_start] + startup[line_end + 1:]
+            moved = move_str + "\n" + count_line + "\n"
+            data[1] = others + "\n" + moved if "\n" in startup else moved
         # Remove any double-spaced lines
         data[1] = data[1].replace("\n\n", "\n")
         return data
@@ -779,79 +672,68 @@ class PurgeLinesAndUnload(Script):
     def _unload_filament(self, data: str) -> str:
         extrude_speed = 3000
         quick_purge_speed = 240
-        retract_amount = self.extruder[0].getProperty("retraction_amount", "value")
+        retract_amount = self.settings["t0_retract_amount"]
         quick_purge_amount = retract_amount + 5 if retract_amount < 2.0 else retract_amount * 2
         unload_distance = self.getSettingValueByKey("unload_distance")
         quick_purge = self.getSettingValueByKey("unload_quick_purge")
-        lines = data[-1].split("\n")
-        for index, line in enumerate(lines):
-            # Unload the filament just before the hot end turns off.
-            if line.startswith("M104") and "S0" in line:
-                filament_str = (
-                    "M83 ; [Unload] Relative extrusion\n"
-                    "M400 ; Complete all moves\n"
-                )
-                if quick_purge:
-                    filament_str += f"G1 F{quick_purge_speed} E{quick_purge_amount} ; Quick Purge before unload\n"
-                if unload_distance > 150:
-                    filament_str += "".join(
-                        f"G1 F{extrude_speed} E-150 ; Unload some\n"
-                        for _ in range(unload_distance // 150)
-                    )
-                    remaining_unload = unload_distance % 150
-                    if remaining_unload > 0:
-                        filament_str += f"G1 F{extrude_speed} E-{remaining_unload} ; Unload the remainder\n"
-                else:
-                    filament_str += f"G1 F{extrude_speed} E-{unload_distance} ; Unload\n"
-                filament_str += (
-                    "M82 ; Absolute Extrusion\n"
-                    "G92 E0 ; Reset Extruder\n"
-                )
-                lines[index] = filament_str + line
-                break
-        data[-1] = "\n".join(lines)
+        # Unload the filament just before the hot end turns off.
+        hotend_off = _HOTEND_OFF_RE.search(data[-1])
+        if hotend_off is None:
+            return data
+        filament_lines = [
+            "M83 ; [Unload] Relative extrusion\n",
+            "M400 ; Complete all moves\n"
+        ]
+        if quick_purge:
+            filament_lines.append(f"G1 F{quick_purge_speed} E{quick_purge_amount} ; Quick Purge before unload\n")
+        if unload_distance > 150:
+            full_chunks, remaining_unload = divmod(unload_distance, 150)
+            filament_lines += [f"G1 F{extrude_speed} E-150 ; Unload some\n"] * full_chunks
+            if remaining_unload > 0:
+                filament_lines.append(f"G1 F{extrude_speed} E-{remaining_unload} ; Unload the remainder\n")
+        else:
+            filament_lines.append(f"G1 F{extrude_speed} E-{unload_distance} ; Unload\n")
+        filament_lines.append("M82 ; Absolute Extrusion\nG92 E0 ; Reset Extruder\n")
+        pos = hotend_off.start()
+        data[-1] = data[-1][:pos] + "".join(filament_lines) + data[-1][pos:]
         return data
 
     # Make an adjustment to the starting E location so the skirt/brim/raft starts out when the nozzle starts out.
     def _adjust_starting_e(self, data: str) -> str:
-        if not self.extruder[0].getProperty("retraction_enable", "value"):
+        if not self.settings["t0_retraction_enable"]:
             return data
         adjust_amount = self.getSettingValueByKey("adjust_e_loc_to")
-        lines = data[1].split("\n")
-        lines.reverse()
-        if self.global_stack.getProperty("machine_firmware_retract", "value"):
-            search_pattern = r"G10"
-        else:
-            search_pattern = r"G1 F(\d*) E-(\d.*)"
-        for index, line in enumerate(lines):
-            if re.search(search_pattern, line):
-                lines[index] = re.sub(search_pattern, f"G92 E{adjust_amount}", line)
-                lines.reverse()
-                data[1] = "\n".join(lines)
-                break
+        search_pattern = _FW_RETRACT_RE if self.settings["firmware_retract"] else _RETRACT_RE
+        # Replace the retraction on the last line of the StartUp that has one
+        last_match = None
+        for last_match in search_pattern.finditer(data[1]):
+            pass
+        if last_match is None:
+            return data
+        line_start = data[1].rfind("\n", 0, last_match.start()) + 1
+        line_end = data[1].find("\n", last_match.end())
+        if line_end == -1:
+            line_end = len(data[1])
+        data[1] = data[1][:line_start] + search_pattern.sub(f"G92 E{adjust_amount}", data[1][line_start:line_end]) + data[1][line_end:]
         return data
 
     # Format the purge or travel-to-start strings.  No reason they shouldn't look nice.
     def _format_string(self, any_gcode_str: str):
-        temp_lines = any_gcode_str.split("\n")
-        gap_len = 0
-        for temp_line in temp_lines:
-            if ";" in temp_line and not temp_line.startswith(";"):
-                if gap_len - len(temp_line.split(";")[0]) + 1 < 0:
-                    gap_len = len(temp_line.split(";")[0]) + 1
-        if gap_len < 30: gap_len = 30
-        for temp_index, temp_line in enumerate(temp_lines):
-            if ";" in temp_line and not temp_line.startswith(";"):
-                temp_lines[temp_index] = temp_line.replace(temp_line.split(";")[0], temp_line.split(";")[0] + str(
-                    " " * (gap_len - len(temp_line.split(";")[0]))), 1)
-            # This formats lines that are commented out but contain additional comments Ex:  ;M420 ; leveling mesh
-            elif temp_line.startswith(";") and ";" in temp_line[1:]:
-                temp_lines[temp_index] = temp_line[1:].replace(temp_line[1:].split(";")[0],
-                                                               ";" + temp_line[1:].split(";")[0] + str(" " * (
-                                                                   gap_len - 1 - len(
-                                                                        temp_line[1:].split(";")[0]))), 1)
-        any_gcode_str = "\n".join(temp_lines)
-        return any_gcode_str
+        # Line the comments up one column past the longest command, but no closer than column 30
+        gap_len = max(30, max((len(code) + 1 for code in _CODE_RE.findall(any_gcode_str)), default=0))
+        # Lines that are commented out but contain additional comments are aligned too  Ex:  ;M420 ; leveling mesh
+        # They aren't measured so one that is longer than the column keeps a single space in front of its comment
+        return _COMMENT_GAP_RE.sub(lambda m: f"{m[1]}{m[2] + ' ':<{gap_len - len(m[1])}}", any_gcode_str)
+
+    # Settings used by more than one procedure are read from the stacks once per run
+    def _gather_settings(self) -> dict:
+        return {
+            "t0_retract_amount": self.extruder[0].getProperty("retraction_amount", "value"),
+            "t0_retraction_enable": self.extruder[0].getProperty("retraction_enable", "value"),
+            "firmware_retract": self.global_stack.getProperty("machine_firmware_retract", "value"),
+            "prime_tower_x": self.global_stack.getProperty("prime_tower_position_x", "value"),
+            "prime_tower_y": self.global_stack.getProperty("prime_tower_position_y", "value")
+        }
 
     def _get_initial_tool(self) -> int:
         # Get the Initial Extruder
@@ -865,17 +747,19 @@ class PurgeLinesAndUnload(Script):
         else:
             self.nozzle_offset_x = 0.0
             self.nozzle_offset_y = 0.0
-        material_diameter = self.extruder[num].getProperty("material_diameter", "value")
-        self.init_line_width = self.extruder[num].getProperty("skirt_brim_line_width", "value")
-        self.print_speed = round(self.extruder[num].getProperty("speed_print", "value") * 60 * .75)
-        self.speed_travel = round(self.extruder[num].getProperty("speed_travel", "value") * 60)
-        self.retract_dist = self.extruder[num].getProperty("retraction_amount", "value")
-        self.retraction_enable = self.extruder[num].getProperty("retraction_enable", "value")
-        self.retract_speed = self.extruder[num].getProperty("retraction_retract_speed", "value") * 60
-        self.mm3_per_mm = (material_diameter / 2) ** 2 * math.pi
+        init_extruder = self.extruder[num]
+        material_diameter = init_extruder.getProperty("material_diameter", "value")
+        self.init_line_width = init_extruder.getProperty("skirt_brim_line_width", "value")
+        self.print_speed = round(init_extruder.getProperty("speed_print", "value") * 60 * .75)
+        self.speed_travel = round(init_extruder.getProperty("speed_travel", "value") * 60)
+        self.retract_dist = init_extruder.getProperty("retraction_amount", "value")
+        self.retraction_enable = init_extruder.getProperty("retraction_enable", "value")
+        self.retract_speed = init_extruder.getProperty("retraction_retract_speed", "value") * 60
+        self.mm3_per_mm = math.pi * (material_diameter * 0.5) ** 2
         # Don't add purge lines if 'T0' has offsets.
-        t0_x_offset = self.extruder[0].getProperty("machine_nozzle_offset_x", "value")
-        t0_y_offset = self.extruder[0].getProperty("machine_nozzle_offset_y", "value")
+        t0 = self.extruder[0]
+        t0_x_offset = t0.getProperty("machine_nozzle_offset_x", "value")
+        t0_y_offset = t0.getProperty("machine_nozzle_offset_y", "value")
         if t0_x_offset or t0_y_offset:
             self.t0_has_offsets = True
         return num
@@ -46,11 +46,12 @@ class ZMoveIDEXToolChanges(Script):
             return data
         start_index = 2
         for num in range(2, len(data) - 1):
-            if ";LAYER:0" in data[num]:
+            # Match the whole marker line.  A bare substring test would also match a longer layer number that starts with the same digits.
+            if data[num].startswith(";LAYER:0\n") or data[num].find("\n;LAYER:0\n") != -1:
                 start_index = num + 1
                 break
         
-        pull_lines = ""
+        pull_lines = []
         extruder = curaApp.extruderList
         prime_rad = curaApp.getProperty("prime_tower_size", "value") * 0.5
         prime_x = curaApp.getProperty("prime_tower_position_x", "value") - prime_rad
@@ -68,30 +69,33 @@ class ZMoveIDEXToolChanges(Script):
                 if not ";TYPE:PRIME-TOWER" in data[num]:
                     continue
                 lines = data[num].split("\n")
-                modified_data = ""
+                modified_data = []
                 for index, line in enumerate(lines):
-                    if line.startswith("M135") or line.startswith("T"):
+                    if line.startswith(("M135", "T")):
                         tower_z += layer_z
                         if tower_z >= ctr_z:
                             #dump blobs in middle of prime tower after it's 20x taller than the nozzle diameter (8mm with a 0.4mm nozzle)
-                            pull_lines = f"\nG1 F{prime_feed} X{prime_x} Y{prime_y}"
+                            pull_lines = [f"G1 F{prime_feed} X{prime_x} Y{prime_y}"]
                         p_index = index
                         # Pull out the lines before the travel moves to the prime tower
-                        while not lines[p_index].startswith(";") and not " Z" in lines[p_index]:
-                            pull_lines += "\n" + lines[p_index]
-                            lines.pop(p_index)
+                        p_end = p_index
+                        while p_end < len(lines) and not lines[p_end].startswith(";") and not " Z" in lines[p_end]:
+                            p_end += 1
+                        if p_end > p_index:
+                            pull_lines.extend(lines[p_index:p_end])
+                            del lines[p_index:p_end]
                         if lines[p_index].startswith("G0 F") and " Z" in lines[p_index]:
-                            modified_data += lines[p_index] + "\n"
+                            modified_data.append(lines[p_index])
                             continue
                     # For situations where there is no MESH:NONMESH line
-                        if lines[p_index].startswith(";TYPE:") and pull_lines != "":
-                            lines[p_index] += pull_lines
-                            modified_data += lines[p_index] + "\n"
+                        if lines[p_index].startswith(";TYPE:") and pull_lines:
+                            lines[p_index] += "\n" + "\n".join(pull_lines)
+                            modified_data.append(lines[p_index])
                         continue
                     # Add the pulled_lines back in after TYPE:PRIME-TOWER
-                    if line.startswith(";TYPE:PRIME-TOWER") and pull_lines != "":
-                        lines[index + paste_line] += pull_lines
-                        pull_lines = ""
-                    modified_data += lines[index] + "\n"
-                data[num] = modified_data[:-1]
+                    if line.startswith(";TYPE:PRIME-TOWER") and pull_lines:
+                        lines[index + paste_line] += "\n" + "\n".join(pull_lines)
+                        pull_lines = []
+                    modified_data.append(lines[index])
+                data[num] = "\n".join(modified_data)
         return data
\ No newline at end of file